@@ -1,15 +1,15 @@
 """
 API Routes untuk Arsip Data
 """
-from fastapi import APIRouter, Query, HTTPException, UploadFile, File, Depends
+from fastapi import APIRouter, Query, HTTPException, UploadFile, File, Depends, Request, Response
 from typing import Optional
 from datetime import date
+import os
 
 from app.schemas import (
     ArsipDataCreate, 
     ArsipDataUpdate, 
     ArsipDataResponse,
-    ArsipDataListResponse,
     UploadResponse,
     MessageResponse
 )
@@ -17,9 +17,11 @@ from app.services.arsip_service import arsip_service
 
 router = APIRouter(prefix="/api/arsip", tags=["Arsip Data"])
 
+ALLOWED_UPLOAD_EXTENSIONS = frozenset({'.csv', '.xlsx', '.xls'})
+
 
 @router.post("", response_model=dict, summary="Create Arsip Data")
-async def create_arsip(data: ArsipDataCreate):
+def create_arsip(data: ArsipDataCreate):
     """
     Tambah data arsip baru.
     
@@ -36,25 +38,33 @@ async def create_arsip(data: ArsipDataCreate):
     return result
 
 
-@router.get("", response_model=ArsipDataListResponse, summary="Get Arsip Data with Filters")
-async def get_arsip_list(
+@router.get("", summary="Get Arsip Data with Filters")
+def get_arsip_list(
+    request: Request,
+    response: Response,
     tanggal_start: Optional[date] = Query(None, description="Tanggal mulai (YYYY-MM-DD)"),
     tanggal_end: Optional[date] = Query(None, description="Tanggal akhir (YYYY-MM-DD)"),
     role_id: Optional[int] = Query(None, description="Filter by Role ID"),
     jenis_arsip: Optional[str] = Query(None, description="Filter by jenis arsip (partial match)"),
     instansi_id: Optional[int] = Query(None, description="Filter by Instansi ID"),
     limit: int = Query(100, ge=1, le=1000, description="Limit hasil"),
-    offset: int = Query(0, ge=0, description="Offset untuk pagination"),
-    _t: Optional[str] = Query(None, description="Cache buster timestamp"),
-    _nocache: Optional[bool] = Query(None, description="Bypass cache")
+    offset: int = Query(0, ge=0, description="Offset untuk pagination")
 ):
     """
     Ambil daftar data arsip dengan filter.
     
     Semua filter bersifat opsional dan bisa dikombinasikan.
+    Mendukung `If-None-Match` (ETag): 304 jika data tidak berubah.
     """
-    # If cache buster is present, skip cache
-    skip_cache = bool(_t) or bool(_nocache)
+    etag = arsip_service.get_filtered_etag(
+        tanggal_start, tanggal_end, role_id, jenis_arsip, instansi_id, limit, offset
+    )
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers={"ETag": etag})
+    
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"  # Always revalidate, never serve blind
     
     return arsip_service.get_filtered(
         tanggal_start=tanggal_start,
@@ -63,20 +73,19 @@ async def get_arsip_list(
         jenis_arsip=jenis_arsip,
         instansi_id=instansi_id,
         limit=limit,
-        offset=offset,
-        skip_cache=skip_cache
+        offset=offset
     )
 
 
 
 @router.get("/statistics", summary="Get Statistics")
-async def get_statistics():
+def get_statistics():
     """Ambil statistik data arsip untuk dashboard"""
     return arsip_service.get_statistics()
 
 
 @router.get("/{arsip_id}", response_model=dict, summary="Get Arsip by ID")
-async def get_arsip_by_id(arsip_id: int):
+def get_arsip_by_id(arsip_id: int):
     """Ambil detail data arsip berdasarkan ID"""
     result = arsip_service.get_by_id(arsip_id)
     if not result:
@@ -85,7 +94,7 @@ async def get_arsip_by_id(arsip_id: int):
 
 
 @router.put("/{arsip_id}", response_model=dict, summary="Update Arsip Data")
-async def update_arsip(arsip_id: int, data: ArsipDataUpdate):
+def update_arsip(arsip_id: int, data: ArsipDataUpdate):
     """Update data arsip berdasarkan ID"""
     result = arsip_service.update(arsip_id, data)
     if result["status"] == "error":
@@ -94,7 +103,7 @@ async def update_arsip(arsip_id: int, data: ArsipDataUpdate):
 
 
 @router.delete("/{arsip_id}", response_model=MessageResponse, summary="Delete Arsip Data")
-async def delete_arsip(arsip_id: int):
+def delete_arsip(arsip_id: int):
     """Hapus data arsip berdasarkan ID"""
     result = arsip_service.delete(arsip_id)
     if result["status"] == "error":
@@ -103,35 +112,30 @@ async def delete_arsip(arsip_id: int):
 
 
 @router.post("/upload", response_model=UploadResponse, summary="Upload CSV/Excel File")
-async def upload_file(file: UploadFile = File(..., description="File CSV atau Excel (.xlsx)")):
+def upload_file(file: UploadFile = File(..., description="File CSV atau Excel (.xlsx)")):
     """
     Upload file CSV atau Excel untuk bulk insert data.
     
     **Format file harus memiliki kolom:**
     - tanggal (YYYY-MM-DD)
-    - role_id (integer)
-    - jenis_arsip (text)
-    - instansi_id (integer)
-    - keterangan (optional)
+    - unit_kerja_id (integer, ID unit kerja yang sudah terdaftar)
     
-    Kolom tambahan akan disimpan di field `data_content` sebagai JSON.
+    Kolom jumlah (optional, default 0): naskah_masuk, naskah_keluar, disposisi, berkas,
+    retensi_permanen, retensi_musnah, naskah_ditindaklanjuti. Kolom total dihitung otomatis.
+    Kolom lain diabaikan.
     """
     # Validate file type
     if not file.filename:
         raise HTTPException(status_code=400, detail="Nama file tidak valid")
     
-    allowed_extensions = ['.csv', '.xlsx', '.xls']
-    if not any(file.filename.lower().endswith(ext) for ext in allowed_extensions):
+    if os.path.splitext(file.filename)[1].lower() not in ALLOWED_UPLOAD_EXTENSIONS:
         raise HTTPException(
             status_code=400, 
             detail="Format file tidak didukung. Gunakan CSV atau Excel (.xlsx, .xls)"
         )
     
-    # Read file content
-    content = await file.read()
-    
-    # Process upload
-    result = arsip_service.upload_file(content, file.filename)
+    # Process upload (stream from the spooled temp file, no full read into memory)
+    result = arsip_service.upload_file(file.file, file.filename)
     
     if result["status"] == "error" and result["rows_inserted"] == 0:
         raise HTTPException(status_code=400, detail=result["errors"][0] if result["errors"] else "Upload gagal")
@@ -140,6 +144,6 @@ async def upload_file(file: UploadFile = File(..., description="File CSV atau Ex
 
 
 @router.get("/cache/stats", summary="Get Cache Statistics")
-async def get_cache_stats():
+def get_cache_stats():
     """Get cache statistics for performance monitoring"""
     return arsip_service.get_cache_stats()
@@ -34,7 +34,7 @@ class TokenResponse(BaseModel):
 
 # === Dependency untuk protected routes ===
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Dependency untuk mendapatkan current user dari token"""
     if not credentials:
         raise HTTPException(status_code=401, detail="Token tidak ditemukan")
@@ -46,7 +46,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     return user
 
 
-async def get_optional_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def get_optional_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Dependency untuk mendapatkan user (optional, tidak error jika tidak ada)"""
     if not credentials:
         return None
@@ -56,7 +56,7 @@ async def get_optional_user(credentials: HTTPAuthorizationCredentials = Depends(
 # === Routes ===
 
 @router.post("/register", summary="Register User Baru")
-async def register(data: UserRegister):
+def register(data: UserRegister):
     """
     Register user baru.
     
@@ -79,7 +79,7 @@ async def register(data: UserRegister):
 
 
 @router.post("/login", summary="Login")
-async def login(data: UserLogin):
+def login(data: UserLogin):
     """
     Login dan dapatkan access token.
     
@@ -103,7 +103,7 @@ async def login(data: UserLogin):
 
 
 @router.get("/me", summary="Get Current User")
-async def get_me(current_user: dict = Depends(get_current_user)):
+def get_me(current_user: dict = Depends(get_current_user)):
     """
     Get informasi user yang sedang login.
     
@@ -113,17 +113,19 @@ async def get_me(current_user: dict = Depends(get_current_user)):
 
 
 @router.post("/logout", summary="Logout")
-async def logout():
+def logout(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """
     Logout user.
     
     Note: Karena menggunakan JWT stateless, logout dilakukan di client-side
-    dengan menghapus token dari storage.
+    dengan menghapus token dari storage. Cache user untuk token ini ikut dihapus.
     """
+    if credentials:
+        auth_service.revoke_cached_user(credentials.credentials)
     return {"status": "success", "message": "Logout berhasil. Hapus token dari client."}
 
 
 @router.get("/verify", summary="Verify Token")
-async def verify_token(current_user: dict = Depends(get_current_user)):
+def verify_token(current_user: dict = Depends(get_current_user)):
     """Verify apakah token masih valid"""
     return {"status": "valid", "user": current_user}
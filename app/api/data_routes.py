@@ -44,7 +44,7 @@ class DataArsipCreate(BaseModel):
 # ==================== INSTANSI ROUTES ====================
 
 @router.get("/instansi", summary="Get All Instansi")
-async def get_instansi(
+def get_instansi(
     limit: int = Query(100, ge=1, le=5000),
     offset: int = Query(0, ge=0)
 ):
@@ -53,7 +53,7 @@ async def get_instansi(
 
 
 @router.get("/instansi/{instansi_id}", summary="Get Instansi by ID")
-async def get_instansi_by_id(instansi_id: int):
+def get_instansi_by_id(instansi_id: int):
     """Get instansi detail by ID"""
     result = data_service.get_instansi_by_id(instansi_id)
     if not result:
@@ -62,7 +62,7 @@ async def get_instansi_by_id(instansi_id: int):
 
 
 @router.post("/instansi", summary="Create Instansi")
-async def create_instansi(data: InstansiCreate):
+def create_instansi(data: InstansiCreate):
     """Create new instansi"""
     result = data_service.create_instansi(kode=data.kode, nama=data.nama)
     if result["status"] == "error":
@@ -71,7 +71,7 @@ async def create_instansi(data: InstansiCreate):
 
 
 @router.put("/instansi/{instansi_id}", summary="Update Instansi")
-async def update_instansi(instansi_id: int, data: InstansiUpdate):
+def update_instansi(instansi_id: int, data: InstansiUpdate):
     """Update existing instansi"""
     result = data_service.update_instansi(
         instansi_id=instansi_id,
@@ -84,7 +84,7 @@ async def update_instansi(instansi_id: int, data: InstansiUpdate):
 
 
 @router.delete("/instansi/{instansi_id}", summary="Delete Instansi")
-async def delete_instansi(instansi_id: int):
+def delete_instansi(instansi_id: int):
     """Delete instansi (cascade deletes unit kerja and data)"""
     result = data_service.delete_instansi(instansi_id)
     if result["status"] == "error":
@@ -95,7 +95,7 @@ async def delete_instansi(instansi_id: int):
 # ==================== UNIT KERJA ROUTES ====================
 
 @router.get("/unit-kerja", summary="Get All Unit Kerja")
-async def get_all_unit_kerja(
+def get_all_unit_kerja(
     limit: int = Query(100, ge=1, le=500),
     offset: int = Query(0, ge=0)
 ):
@@ -104,7 +104,7 @@ async def get_all_unit_kerja(
 
 
 @router.get("/instansi/{instansi_id}/unit-kerja", summary="Get Unit Kerja by Instansi")
-async def get_unit_kerja_by_instansi(
+def get_unit_kerja_by_instansi(
     instansi_id: int,
     limit: int = Query(100, ge=1, le=5000),
     offset: int = Query(0, ge=0)
@@ -118,7 +118,7 @@ async def get_unit_kerja_by_instansi(
 
 
 @router.post("/unit-kerja", summary="Create Unit Kerja")
-async def create_unit_kerja(data: UnitKerjaCreate):
+def create_unit_kerja(data: UnitKerjaCreate):
     """Create new unit kerja under an instansi"""
     result = data_service.create_unit_kerja(
         instansi_id=data.instansi_id,
@@ -134,7 +134,7 @@ class UnitKerjaUpdate(BaseModel):
     nama: Optional[str] = None
 
 @router.put("/unit-kerja/{unit_id}", summary="Update Unit Kerja")
-async def update_unit_kerja(unit_id: int, data: UnitKerjaUpdate):
+def update_unit_kerja(unit_id: int, data: UnitKerjaUpdate):
     """Update existing unit kerja"""
     result = data_service.update_unit_kerja(
         unit_id=unit_id,
@@ -147,7 +147,7 @@ async def update_unit_kerja(unit_id: int, data: UnitKerjaUpdate):
 
 
 @router.delete("/unit-kerja/{unit_id}", summary="Delete Unit Kerja")
-async def delete_unit_kerja(unit_id: int):
+def delete_unit_kerja(unit_id: int):
     """Delete unit kerja (cascade deletes data arsip)"""
     result = data_service.delete_unit_kerja(unit_id)
     if result["status"] == "error":
@@ -158,7 +158,7 @@ async def delete_unit_kerja(unit_id: int):
 # ==================== DATA ARSIP ROUTES ====================
 
 @router.get("/data-arsip", summary="Get Data Arsip")
-async def get_data_arsip(
+def get_data_arsip(
     unit_kerja_id: Optional[int] = None,
     instansi_id: Optional[int] = None,
     tanggal_start: Optional[date] = None,
@@ -178,7 +178,7 @@ async def get_data_arsip(
 
 
 @router.post("/data-arsip", summary="Create/Update Data Arsip")
-async def create_data_arsip(data: DataArsipCreate):
+def create_data_arsip(data: DataArsipCreate):
     """Create or update data arsip for a unit kerja on a specific date"""
     result = data_service.create_or_update_data_arsip(
         unit_kerja_id=data.unit_kerja_id,
@@ -197,7 +197,7 @@ async def create_data_arsip(data: DataArsipCreate):
 
 
 @router.delete("/data-arsip/{data_id}", summary="Delete Data Arsip")
-async def delete_data_arsip(data_id: int):
+def delete_data_arsip(data_id: int):
     """Delete a specific data arsip entry"""
     result = data_service.delete_data_arsip(data_id)
     if result["status"] == "error":
@@ -208,12 +208,12 @@ async def delete_data_arsip(data_id: int):
 # ==================== STATISTICS ====================
 
 @router.get("/statistics", summary="Get Dashboard Statistics")
-async def get_statistics():
+def get_statistics():
     """Get aggregated statistics for dashboard"""
     return data_service.get_statistics()
 
 
 @router.get("/summary/by-instansi", summary="Get Summary by Instansi")
-async def get_summary_by_instansi():
+def get_summary_by_instansi():
     """Get data summary grouped by instansi"""
     return data_service.get_summary_by_instansi()
@@ -2,18 +2,306 @@
 API Routes untuk Statistik - Grafana Integration
 Endpoint khusus untuk integrasi dengan Grafana JSON Datasource
 """
-from fastapi import APIRouter, HTTPException, Query
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Query, Request, Response
+from fastapi.responses import ORJSONResponse
 from typing import Optional, List
-from datetime import datetime
-from sqlalchemy import text
-from sqlalchemy.orm import joinedload
+from datetime import date, datetime
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import logging
+import re
+import time
+import orjson
+from sqlalchemy import text, bindparam
 
+from app.config import get_settings
 from app.database import get_db_context
 from app.models.table_models import TableDefinition
 from app.services.cache_service import cache
+from app.services.table_service import table_service
 
-router = APIRouter(prefix="/api/stats", tags=["Statistics - Grafana"])
+logger = logging.getLogger(__name__)
+
+# orjson for every endpoint here; handlers return ORJSONResponse directly to skip jsonable_encoder
+router = APIRouter(prefix="/api/stats", tags=["Statistics - Grafana"], default_response_class=ORJSONResponse)
+
+settings = get_settings()
+
+# Dropdown lists only change through admin writes, which bump the global 'grafana' version
+VAR_CACHE_TTL = 600
+# Browser/Grafana may reuse a dropdown list briefly, then revalidate it with If-None-Match
+VAR_HTTP_CACHE_CONTROL = "public, max-age=300, stale-while-revalidate=60"
+
+# Month names indexed by month number (index 0 unused). English matches MySQL MONTHNAME().
+MONTH_NAMES = ('', 'Januari', 'Februari', 'Maret', 'April', 'Mei', 'Juni',
+               'Juli', 'Agustus', 'September', 'Oktober', 'November', 'Desember')
+MONTH_NAMES_EN = ('', 'January', 'February', 'March', 'April', 'May', 'June',
+                  'July', 'August', 'September', 'October', 'November', 'December')
+
+# Dropdown list queries, built once at import and reused by every request
+SQL_INSTANSI_LIST = text("SELECT id, kode, nama FROM instansi ORDER BY nama")
+SQL_UNIT_KERJA_BY_INSTANSI = text(
+    "SELECT id, kode, nama, instansi_id FROM unit_kerja WHERE instansi_id = :instansi_id ORDER BY nama"
+)
+SQL_UNIT_KERJA_LIST = text(
+    "SELECT u.id, u.kode, u.nama, u.instansi_id, i.nama as instansi_nama "
+    "FROM unit_kerja u LEFT JOIN instansi i ON u.instansi_id = i.id ORDER BY i.nama, u.nama"
+)
+# Dropdown values are strings: ids come back already cast by MySQL
+SQL_VAR_INSTANSI = text("SELECT CAST(id AS CHAR) as sid, nama FROM instansi ORDER BY nama")
+SQL_VAR_UNIT_KERJA_IN = text(
+    "SELECT CAST(id AS CHAR) as sid, nama FROM unit_kerja WHERE instansi_id IN :instansi_ids ORDER BY nama"
+).bindparams(bindparam("instansi_ids", expanding=True))
+# Label "unit (instansi)" is assembled by the DB; units without an instansi keep their bare name
+SQL_VAR_UNIT_KERJA_ALL = text(
+    "SELECT CAST(u.id AS CHAR) as sid, COALESCE(CONCAT(u.nama, ' (', NULLIF(i.nama, ''), ')'), u.nama) as label "
+    "FROM unit_kerja u LEFT JOIN instansi i ON u.instansi_id = i.id ORDER BY i.nama, u.nama"
+)
+
+# /yearly entries are served for up to an hour; past grafana_cache_ttl a hit also refreshes them
+YEARLY_STALE_TTL = 3600
+
+# Per-table fallback queries of /grafana/combined run in parallel, one pooled connection each
+COMBINED_FALLBACK_WORKERS = 4
+
+# Whole numeric tokens of a Grafana multi-value: "1,2", "{1,2}" ('$__all', '${var}' yield nothing)
+INT_TOKEN = re.compile(r'(?<![^\s,{}])\d+(?![^\s,{}])')
+
+
+def _parse_int_list(raw: Optional[str]) -> List[int]:
+    """Parse a Grafana multi-value / glob query parameter into ints in one pass"""
+    return [int(token) for token in INT_TOKEN.findall(raw)] if raw else []
+
+
+def _etag_response(data, request: Request) -> Response:
+    """JSON response with a content-hash ETag; 304 without a body when the client's copy matches"""
+    body = orjson.dumps(data)
+    etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": VAR_HTTP_CACHE_CONTROL}
+    if etag in (tag.strip() for tag in request.headers.get("if-none-match", "").split(",")):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def _grafana_cache_key(endpoint: str, *params, table_ids=(), all_tables: bool = False) -> str:
+    """
+    Cache key: endpoint + the versions its data depends on + a fixed-size hash of the parameters.
+    A data write to one table bumps only that table's version (see invalidate_grafana_cache);
+    all_tables=True is for responses built from every table's data.
+    """
+    versions = [cache.get_version("grafana")]
+    versions.extend(cache.get_version(f"grafana:table:{tid}") for tid in table_ids)
+    if all_tables:
+        versions.append(cache.get_version("grafana:data"))
+    param_hash = hashlib.blake2b(repr(params).encode(), digest_size=8).hexdigest()
+    return f"grafana:{endpoint}:v{'.'.join(map(str, versions))}:{param_hash}"
+
+
+@lru_cache(maxsize=256)
+def _compiled_text(sql: str, expanding: tuple):
+    """Parsed text() construct per distinct SQL string (dashboards repeat the same few shapes)"""
+    stmt = text(sql)
+    return stmt.bindparams(*(bindparam(name, expanding=True) for name in expanding)) if expanding else stmt
+
+
+def _stmt(sql: str, params: dict):
+    """text() with every list-valued param bound as an expanding IN (...) parameter"""
+    expanding = tuple(sorted(name for name, value in params.items() if isinstance(value, (list, tuple))))
+    return _compiled_text(sql, expanding)
+
+
+def _fetch_rows_or_empty(sql: str, params: dict) -> list:
+    """Run one query in its own session (safe in a worker thread); a failing query yields no rows"""
+    try:
+        with get_db_context() as db:
+            return db.execute(_stmt(sql, params), params).all()
+    except Exception:
+        logger.exception("Per-table fallback query failed; its rows are skipped")
+        return []
+
+
+def _tanggal_range_condition(years, params: dict, column: str = "t.tanggal", months=None) -> str:
+    """
+    Sargable replacement for YEAR(tanggal) IN (...) [AND MONTH(tanggal) IN (...)]:
+    one half-open date range per run of consecutive selected months, so the tanggal
+    index can be range-scanned. Without months every month of the years is selected.
+    """
+    month_list = sorted(set(m for m in months if 1 <= m <= 12)) if months else range(1, 13)
+    runs = []
+    # Months as ordinals (year * 12 + month - 1) so runs merge across year boundaries too
+    for ordinal in sorted(y * 12 + m - 1 for y in set(years) if 1 <= y < 9999 for m in month_list):
+        if runs and runs[-1][1] == ordinal:
+            runs[-1][1] = ordinal + 1
+        else:
+            runs.append([ordinal, ordinal + 1])
+    if not runs:
+        return "1 = 0"
+    
+    ranges = []
+    for i, (start, end) in enumerate(runs):
+        params[f"tanggal_start_{i}"] = date(start // 12, start % 12 + 1, 1)
+        params[f"tanggal_end_{i}"] = date(end // 12, end % 12 + 1, 1)
+        ranges.append(f"{column} >= :tanggal_start_{i} AND {column} < :tanggal_end_{i}")
+    return ranges[0] if len(ranges) == 1 else "(" + " OR ".join(f"({r})" for r in ranges) + ")"
+
+
+def _build_filters(year_list, month_filter, instansi_ids=(), unit_kerja_ids=(), use_summary: bool = False,
+                   unit_overrides_instansi: bool = False):
+    """
+    Shared WHERE/JOIN builder for the monthly-style aggregations over alias 't'.
+    Returns (join_clause, where_clause, params).
+    
+    - Raw tables filter on tanggal ranges; summary tables on their year/'YYYY-MM' month columns.
+    - unit_kerja_ids and instansi_ids are ANDed; unit_kerja is only joined for the instansi filter.
+      With unit_overrides_instansi (the /monthly endpoint's historical behaviour) unit_kerja_ids,
+      when given, replaces the instansi filter instead.
+    """
+    where_conditions = []
+    params = {}
+    
+    # 1+2. Year / Month Filter
+    if use_summary:
+        if year_list and month_filter:
+            # Exact 'YYYY-MM' keys: seeks on the summary's (month, unit_kerja_id) primary key
+            where_conditions.append("t.month IN :year_months")
+            params["year_months"] = [f"{y}-{m:02d}" for y in year_list for m in month_filter]
+        elif year_list:
+            # Summary table (generic and data_arsip_monthly_summary) has a 'year' column
+            if len(year_list) == 1:
+                where_conditions.append("t.year = :year")
+                params["year"] = year_list[0]
+            else:
+                where_conditions.append("t.year IN :years")
+                params["years"] = list(year_list)
+        elif month_filter:
+            # Summary 't.month' is 'YYYY-MM', compare its zero-padded MM part
+            where_conditions.append("SUBSTRING(t.month, 6, 2) IN :months")
+            params["months"] = [f"{m:02d}" for m in month_filter]
+    elif year_list:
+        # Raw tables: ranges on tanggal (index-friendly), never YEAR()/MONTH() of tanggal
+        where_conditions.append(_tanggal_range_condition(year_list, params, months=month_filter))
+    elif month_filter:
+        where_conditions.append("MONTH(t.tanggal) IN :months")
+        params["months"] = list(month_filter)
+    
+    # 3. Unit/Instansi Filter
+    join_clause = ""
+    if unit_kerja_ids:
+        if len(unit_kerja_ids) == 1:
+            where_conditions.append("t.unit_kerja_id = :unit_kerja_id")
+            params["unit_kerja_id"] = unit_kerja_ids[0]
+        else:
+            where_conditions.append("t.unit_kerja_id IN :unit_kerja_ids")
+            params["unit_kerja_ids"] = list(unit_kerja_ids)
+    if instansi_ids and not (unit_kerja_ids and unit_overrides_instansi):
+        join_clause = "JOIN unit_kerja u ON t.unit_kerja_id = u.id"
+        if len(instansi_ids) == 1:
+            where_conditions.append("u.instansi_id = :instansi_id")
+            params["instansi_id"] = instansi_ids[0]
+        else:
+            where_conditions.append("u.instansi_id IN :instansi_ids")
+            params["instansi_ids"] = list(instansi_ids)
+    
+    where_clause = f"WHERE {' AND '.join(where_conditions)}" if where_conditions else ""
+    return join_clause, where_clause, params
+
+
+def _int_series(alias: str, values) -> str:
+    """Derived table of integer literals: SELECT 1 AS m UNION ALL SELECT 2 AS m ..."""
+    return " UNION ALL ".join(f"SELECT {int(v)} AS {alias}" for v in values)
+
+
+@lru_cache(maxsize=512)
+def _monthly_sql(safe_table_name: str, selected_cols: tuple, use_summary: bool,
+                 join_clause: str, where_clause: str, fill_years: tuple, fill_months: tuple) -> str:
+    """
+    SQL for /grafana/monthly, memoized per query shape (filter values are bound, not embedded).
+    With fill_years/fill_months the aggregate is LEFT JOINed onto a dense (year x month) grid.
+    """
+    # Build SQL based on source type
+    if use_summary:
+        select_month = "t.month"
+        select_month_name = "MONTHNAME(STR_TO_DATE(CONCAT(t.month, '-01'), '%Y-%m-%d'))"
+        group_by = "t.month"
+    else:
+        select_month = "DATE_FORMAT(t.tanggal, '%Y-%m')"
+        select_month_name = "MONTHNAME(t.tanggal)"
+        group_by = "DATE_FORMAT(t.tanggal, '%Y-%m')"
+    
+    if fill_years and fill_months:
+        # Dense (year x month) grid LEFT JOINed to the aggregate: months without data
+        # come back as zero rows, already in order, so Python never patches them in.
+        agg_expressions = [f"SUM(t.{col}) as `{col}`" for col in selected_cols]
+        fill_expressions = [f"COALESCE(a.`{col}`, 0) as `{col}`" for col in selected_cols]
+        return f"""
+            SELECT 
+                g.bulan,
+                MONTHNAME(CONCAT(g.bulan, '-01')) as nama_bulan,
+                {', '.join(fill_expressions)}
+            FROM (
+                SELECT CONCAT(y.year, '-', LPAD(m.month, 2, '0')) as bulan
+                FROM ({_int_series('year', fill_years)}) y
+                CROSS JOIN ({_int_series('month', fill_months)}) m
+            ) g
+            LEFT JOIN (
+                SELECT 
+                    {select_month} as bulan,
+                    {', '.join(agg_expressions)}
+                FROM {safe_table_name} t
+                {join_clause}
+                {where_clause}
+                GROUP BY {group_by}
+            ) a ON a.bulan = g.bulan
+            ORDER BY g.bulan
+        """
+    
+    sum_expressions = [f"COALESCE(SUM(t.{col}), 0) as `{col}`" for col in selected_cols]
+    return f"""
+        SELECT 
+            {select_month} as bulan,
+            {select_month_name} as nama_bulan,
+            {', '.join(sum_expressions)}
+        FROM {safe_table_name} t
+        {join_clause}
+        {where_clause}
+        GROUP BY {group_by}
+        ORDER BY {group_by}
+    """
+
+
+@lru_cache(maxsize=256)
+def _yearly_select_sql(source: str, use_summary: bool, sum_expressions: tuple) -> str:
+    """
+    Per-year SUM query, one SQL text per (source, columns): the years are an expanding bind,
+    the raw table is range-scanned on tanggal between the first and last selected year.
+    """
+    year_expr = "t.year" if use_summary else "YEAR(t.tanggal)"
+    condition = "t.year IN :years" if use_summary else (
+        "t.tanggal >= :tanggal_start AND t.tanggal < :tanggal_end AND YEAR(t.tanggal) IN :years"
+    )
+    return f"""
+        SELECT 
+            {year_expr} as tahun,
+            {', '.join(sum_expressions)}
+        FROM {source} t
+        WHERE {condition}
+        GROUP BY {year_expr}
+        ORDER BY tahun
+    """
+
+
+def _yearly_sql(table, sum_cols: tuple, year_list, params: dict) -> str:
+    """Per-year SUMs of sum_cols; read from the monthly roll-up when it has every column"""
+    summary_table = table.summary_for(sum_cols)
+    years = sorted(set(y for y in year_list if 1 <= y < 9999))
+    params["years"] = years
+    if not summary_table:
+        params["tanggal_start"] = date(years[0], 1, 1) if years else date.min
+        params["tanggal_end"] = date(years[-1] + 1, 1, 1) if years else date.min
+    return _yearly_select_sql(
+        summary_table or table.safe_name, bool(summary_table), tuple(table.sum_sql[col] for col in sum_cols)
+    )
 
 
 # ============================================
@@ -44,23 +332,25 @@ def get_grafana_monthly(
     - unit_kerja_id=1 akan filter berdasarkan unit kerja
     - year=2024,2025 filter tahun (support multi)
     """
-    # 1. Try Cache (v15: Force Invalidate previous cache)
-    cache_key = f"grafana:v15:monthly:{table_id}:{year}:{columns}:{instansi_id}:{unit_kerja_id}:{include_total_col}:{exclude_meta}:{months}:{format}"
+    # 1. Try Cache
+    cache_key = _grafana_cache_key(
+        "monthly", table_id, year, columns, months, instansi_id, unit_kerja_id,
+        use_display_name, exclude_meta, include_total_col, format,
+        table_ids=(table_id,)
+    )
     cached_data = cache.get(cache_key)
-    if cached_data:
-        return cached_data
+    if cached_data is not None:
+        return ORJSONResponse(cached_data)
 
     # Parse year (handle $__all and multi-value)
     year_list = []
     is_all_years = False
     if year:
         # Detect Grafana $__all or "All" — skip year filter entirely
-        clean_year_str = str(year).replace('{', '').replace('}', '').strip()
-        if clean_year_str.lower() in ('all', '$__all', ''):
+        if year.strip('{} ').lower() in ('all', '$__all', ''):
             is_all_years = True
         else:
-            raw_years = [int(y.strip()) for y in clean_year_str.split(',') if y.strip().isdigit()]
-            year_list = sorted(list(set(raw_years)), reverse=True)
+            year_list = sorted(set(_parse_int_list(year)), reverse=True)
     
     # If no valid year parsed AND not explicitly "All", logic depends on whether year arg was provided
     if not year_list and not is_all_years:
@@ -73,41 +363,24 @@ def get_grafana_monthly(
             year_list = [datetime.now().year]
     
     # Parse instansi_id (handle $__all and multi-value with Grafana glob {1,2})
-    instansi_ids = []
-    if instansi_id:
-        # cleanup input: remove { } and whitespace
-        clean_instansi = instansi_id.replace('{', '').replace('}', '')
-        instansi_ids = [int(x.strip()) for x in clean_instansi.split(',') if x.strip().isdigit()]
+    instansi_ids = _parse_int_list(instansi_id)
 
     # Parse unit_kerja_id (handle $__all and multi-value with Grafana glob {1,2})
-    unit_kerja_ids = []
-    if unit_kerja_id:
-        clean_uk = unit_kerja_id.replace('{', '').replace('}', '')
-        unit_kerja_ids = [int(x.strip()) for x in clean_uk.split(',') if x.strip().isdigit()]
+    unit_kerja_ids = _parse_int_list(unit_kerja_id)
     
     # Parse months filter
-    month_filter = None
-    if months:
-        clean_months = months.replace('{', '').replace('}', '')
-        month_filter = [int(m.strip()) for m in clean_months.split(',') if m.strip().isdigit()]
+    month_filter = _parse_int_list(months)
+    
+    table = table_service.get_table_meta(table_id)
+    if not table:
+        return []
     
     with get_db_context() as db:
-        table = db.query(TableDefinition).options(
-            joinedload(TableDefinition.columns)
-        ).filter(TableDefinition.id == table_id).first()
-        
-        if not table:
-            return []
-        
-        safe_table_name = table.name.replace('-', '_').replace(' ', '_')
-        
-        
         # Build column mapping: name -> display_name
-        col_mapping = {c.name: c.display_name for c in table.columns}
         # Add 'total' to mapping manually so it displays nicely
-        col_mapping["total"] = "Total"
+        col_mapping = {**table.col_mapping, "total": "Total"}
         
-        available_cols = [c.name for c in table.columns if c.is_summable]
+        available_cols = list(table.summable_cols)
         
         # FIX: Ensure 'total' is available for selection
         if "total" not in available_cols:
@@ -129,103 +402,18 @@ def get_grafana_monthly(
             if "total" in selected_cols:
                 selected_cols.remove("total")
         
-        # Define sum expressions
-        sum_expressions = [f"COALESCE(SUM(t.{col}), 0) as `{col}`" for col in selected_cols]
-        
-        # FIX: Define include_total for downstream logic (Deprecated but kept for safety if needed)
-        # But we remove manual usage downstream!
-        include_total = False 
-        
-        # Build WHERE conditions
-        where_conditions = []
-        params = {}
-        
         # SUPER OPTIMIZATION: Use Summary Table (Materialized View)
-        from app.services.generic_summary_service import GenericSummaryService
-        summary_service = GenericSummaryService(db)
-        
-        # Check if generic summary exists for this table
-        has_summary = summary_service.check_summary_exists(table.id)
-        
-        # Determine strict summary usage
-        # We use summary if available AND we are not asking for raw-only columns (which we assume standard columns are in summary)
-        # Determine strict summary usage
-        # We use summary if available AND we are not asking for raw-only columns (which we assume standard columns are in summary)
-        use_summary = has_summary
-        
-        if use_summary:
-            safe_table_name = summary_service.get_summary_table_name(table.id)
-        else:
-            safe_table_name = table.name.replace('-', '_').replace(' ', '_')
+        # Only when it exists AND has every selected column (resolved on the cached metadata)
+        summary_table = table.summary_for(selected_cols)
+        use_summary = summary_table is not None
+        safe_table_name = summary_table or table.safe_name
         
         # Adjust where conditions for Summary Table
         # Summary has 'year' and 'month' columns directly.
         # Raw table has 'tanggal'.
-        
-        where_conditions = []
-        params = {}
-        
-        # 1. Year Filter
-        if year_list:
-            if use_summary:
-                # Summary table (generic) has 'year' column
-                col_year = "t.year"
-            elif table.name == "data_arsip":
-                 # Old data_arsip summary also has 'year' (from previous session)
-                 # Wait, create_summary_table.py created: month (VARCHAR), year (INT)??
-                 # No, create_summary_table.py ONLY created 'month'.
-                 # BUT data_arsip_monthly_summary likely has 'month' as 'YYYY-MM'.
-                 # So we need to extract year from month if 'year' column is missing or just use substring.
-                 # Actually, let's assume Generic Service adds 'year'. 
-                 # OLD summary table might NOT have 'year'.
-                 # Let's check logic:
-                 # If generic summary -> it has 'year'.
-                 # If data_arsip -> we used 't.year' in previous code, implies it has it?
-                 # Let's check view_file of create_summary_table.py... IDK.
-                 # Safe bet: use strict SQL based on table type.
-                 col_year = "t.year" 
-            else:
-                col_year = "YEAR(t.tanggal)"
-
-            if len(year_list) == 1:
-                where_conditions.append(f"{col_year} = :year")
-                params["year"] = year_list[0]
-            else:
-                where_conditions.append(f"{col_year} IN ({','.join(str(y) for y in year_list)})")
-        
-        # 2. Month Filter
-        if month_filter:
-             # Summary: 't.month' is 'YYYY-MM'. We need to filter by MM part?
-             # OR does summary have 'month_int'? No.
-             # Client sends month_filter = [1, 2, 12].
-             # If summary: SUBSTRING(t.month, 6, 2) IN (01, 02, 12)
-             # If raw: MONTH(t.tanggal) IN (1, 2, 12)
-             
-             if use_summary:
-                 # Helper to pad zero
-                 months_padded = [f"'{m:02d}'" for m in month_filter]
-                 where_conditions.append(f"SUBSTRING(t.month, 6, 2) IN ({','.join(months_padded)})")
-             else:
-                 where_conditions.append(f"MONTH(t.tanggal) IN ({','.join(str(m) for m in month_filter)})")
-        
-        # 3. Unit/Instansi Filter (Same logic as before, but safer)
-        need_join = True
-        if unit_kerja_ids:
-             need_join = False
-             if len(unit_kerja_ids) == 1:
-                 where_conditions.append("t.unit_kerja_id = :unit_kerja_id")
-                 params["unit_kerja_id"] = unit_kerja_ids[0]
-             else:
-                 where_conditions.append(f"t.unit_kerja_id IN ({','.join(str(u) for u in unit_kerja_ids)})")
-        elif instansi_ids:
-             need_join = True
-             if len(instansi_ids) == 1:
-                 where_conditions.append("u.instansi_id = :instansi_id")
-                 params["instansi_id"] = instansi_ids[0]
-             else:
-                 where_conditions.append(f"u.instansi_id IN ({','.join(str(i) for i in instansi_ids)})")
-        
-        join_clause = "LEFT JOIN unit_kerja u ON t.unit_kerja_id = u.id" if need_join else ""
+        join_clause, where_clause, params = _build_filters(
+            year_list, month_filter, instansi_ids, unit_kerja_ids, use_summary, unit_overrides_instansi=True
+        )
         
         # 4. Grouping (Already grouped in summary, but we group again to aggregate across units if needed)
         # If we select "All Units", we get 2000 rows (1 row per unit per month).
@@ -236,135 +424,44 @@ def get_grafana_monthly(
         # Let's check the original GROUP BY: "GROUP BY MONTH(t.tanggal)".
         # Yes, it aggregates all units into one row per month.
         
-        # Build SQL based on source type
-        if use_summary:
-            select_month = "t.month"
-            select_month_name = "MONTHNAME(STR_TO_DATE(CONCAT(t.month, '-01'), '%Y-%m-%d'))"
-            group_by = "t.month"
-        else:
-            select_month = "DATE_FORMAT(t.tanggal, '%Y-%m')"
-            select_month_name = "MONTHNAME(t.tanggal)"
-            group_by = "DATE_FORMAT(t.tanggal, '%Y-%m')"
-
-        where_clause = f"WHERE {' AND '.join(where_conditions)}" if where_conditions else ""
-
-        sql = f"""
-            SELECT 
-                {select_month} as bulan,
-                {select_month_name} as nama_bulan,
-                {', '.join(sum_expressions)}
-            FROM {safe_table_name} t
-            {join_clause}
-            {where_clause}
-            GROUP BY {group_by}
-            ORDER BY {group_by}
-        """
+        is_timeseries = bool(format) and format.lower() == 'timeseries'
+        include_meta = not exclude_meta or is_timeseries
+        
+        # Only fill missing months if we have a specific year context (year_list is not empty)
+        # If viewing "All Years", filling months for "Current Year" (default) is confusing/wrong.
+        months_to_fill = [m for m in (month_filter or range(1, 13)) if 1 <= m <= 12]
+        fill_months = include_meta and year_list and months_to_fill
+        
+        sql = _monthly_sql(
+            safe_table_name, tuple(selected_cols), use_summary, join_clause, where_clause,
+            tuple(year_list) if fill_months else (), tuple(months_to_fill) if fill_months else ()
+        )
         
         try:
-            result = db.execute(text(sql), params).mappings().all()
+            # Plain tuples in SELECT order: bulan, nama_bulan, then selected_cols
+            result = db.execute(_stmt(sql, params), params).all()
         except Exception as e:
             return []
         
-        monthly_data = []
-        is_timeseries = format and format.lower() == 'timeseries'
-        try:
-            with open("d:\\splp-integrator\\debug_route.log", "a") as f:
-                f.write(f"TS_DEBUG: Format={format}, IsTS={is_timeseries}, ExcludeMeta={exclude_meta}\n")
-        except:
-            pass
-        for row in result:
-            row_dict = dict(row)
-            if use_display_name:
-                # Convert column names to display names
-                new_row = {}
-                if not exclude_meta or is_timeseries:
-                    new_row['Bulan'] = row_dict['bulan']
-                    new_row['Nama Bulan'] = row_dict['nama_bulan']
-                
-                # Cast Total
-                if include_total:
-                    val = row_dict.get('total', 0)
-                    try: new_row['Total'] = int(val)
-                    except: new_row['Total'] = 0
-                
-                # Cast Columns
-                for col in selected_cols:
-                    display = col_mapping.get(col, col)
-                    val = row_dict.get(col, 0)
-                    try: new_row[display] = int(val)
-                    except: new_row[display] = 0
-                
-                monthly_data.append(new_row)
-            else:
-                if exclude_meta and not is_timeseries:
-                    row_dict.pop('bulan', None)
-                    row_dict.pop('nama_bulan', None)
-                
-                # Cast Total
-                if include_total:
-                    val = row_dict.get('total', 0)
-                    try: row_dict['total'] = int(val)
-                    except: row_dict['total'] = 0
-
-                # Cast Columns
-                for col in selected_cols:
-                    val = row_dict.get(col, 0)
-                    try: row_dict[col] = int(val)
-                    except: row_dict[col] = 0
-                
-                monthly_data.append(row_dict)
+        # Resolve output keys once; each row is then a single zip over its values
+        if use_display_name:
+            bulan_key, nama_bulan_key = 'Bulan', 'Nama Bulan'
+            value_keys = [col_mapping.get(col, col) for col in selected_cols]
+        else:
+            bulan_key, nama_bulan_key = 'bulan', 'nama_bulan'
+            value_keys = selected_cols
         
-        # Only fill missing months if we have a specific year context (year_list is not empty)
-        # If viewing "All Years", filling months for "Current Year" (default) is confusing/wrong.
-        if (not exclude_meta or is_timeseries) and year_list:
-            # Fill missing months (only for filtered months or all if no filter)
-            # Ensure Bulan is treated as int for comparison (DB might return string if exclude_meta logic processed it)
-            existing_months = set()
-            for d in monthly_data:
-                try:
-                    val = d.get('Bulan') or d.get('bulan')
-                    if val:
-                        # Handle YYYY-MM format if present
-                        if isinstance(val, str) and '-' in val:
-                            existing_months.add(int(val.split('-')[1]))
-                        else:
-                            existing_months.add(int(val))
-                except (ValueError, TypeError, IndexError):
-                    pass
-            month_names = ['', 'Januari', 'Februari', 'Maret', 'April', 'Mei', 'Juni',
-                           'Juli', 'Agustus', 'September', 'Oktober', 'November', 'Desember']
-            
-            # Determine which months to fill (filtered or all)
-            months_to_fill = month_filter if month_filter else list(range(1, 13))
-            
-            
-            print(f"DEBUG: Filling months for {months_to_fill}")
-            for m in months_to_fill:
-                if m not in existing_months:
-                    if use_display_name:
-                        zero_row = {'Bulan': m, 'Nama Bulan': month_names[m]}
-                        if include_total:
-                            zero_row['Total'] = 0
-                        for col in selected_cols:
-                            display = col_mapping.get(col, col)
-                            zero_row[display] = 0
-                    else:
-                        zero_row = {'bulan': m, 'nama_bulan': month_names[m]}
-                        if include_total:
-                            zero_row['total'] = 0
-                        for col in selected_cols:
-                            zero_row[col] = 0
-                    monthly_data.append(zero_row)
-            
-            try:
-                monthly_data.sort(key=lambda x: x.get('Bulan') or x.get('bulan') or 0)
-            except Exception as e:
-                pass
+        if include_meta:
+            monthly_data = [
+                {bulan_key: bulan, nama_bulan_key: nama_bulan, **dict(zip(value_keys, map(int, values)))}
+                for bulan, nama_bulan, *values in result
+            ]
+        else:
+            monthly_data = [dict(zip(value_keys, map(int, values))) for _, _, *values in result]
         
         # PIE CHART AGGREGATION: When exclude_meta=true (pie chart mode),
         # aggregate all rows into a single sum row so the pie chart shows correct totals
         # BUT skip this if format=timeseries (because timeseries needs rows to be separate)
-        is_timeseries = format and format.lower() == 'timeseries'
         if exclude_meta and len(monthly_data) > 1 and not is_timeseries:
             aggregated = {}
             for row in monthly_data:
@@ -442,9 +539,8 @@ def get_grafana_monthly(
             monthly_data = reordered
 
         # Return FLAT ARRAY directly (no wrapper!)
-        # Cache Result (5 minutes)
-        cache.set(cache_key, monthly_data, ttl=300)
-        return monthly_data
+        cache.set(cache_key, monthly_data, ttl=settings.grafana_cache_ttl)
+        return ORJSONResponse(monthly_data)
 
 
 @router.get("/grafana/combined")
@@ -465,159 +561,138 @@ def get_grafana_combined(
     Mendukung filter instansi_id, unit_kerja_id, dan months.
     """
     # 1. Try Cache
-    cache_key = f"grafana:combined:{table_ids}:{year}:{instansi_id}:{unit_kerja_id}:{months}:{use_display_name}"
+    cache_key = _grafana_cache_key(
+        "combined", table_ids, year, instansi_id, unit_kerja_id, months, use_display_name,
+        table_ids=dict.fromkeys(_parse_int_list(table_ids))
+    )
     cached_data = cache.get(cache_key)
-    if cached_data:
-        return cached_data
+    if cached_data is not None:
+        return ORJSONResponse(cached_data)
 
     # Parse year (handle $__all and multi-value)
     year_list = []
     is_all_years = False
     if year:
-        clean_year_str = str(year).replace('{', '').replace('}', '').strip()
-        if clean_year_str.lower() in ('all', '$__all', ''):
+        if year.strip('{} ').lower() in ('all', '$__all', ''):
             is_all_years = True
         else:
-            year_list = [int(y.strip()) for y in clean_year_str.split(',') if y.strip().isdigit()]
+            year_list = _parse_int_list(year)
     
     if not year_list and not is_all_years:
         year_list = [datetime.now().year]
     
     # Parse instansi_id (handle $__all and multi-value with Grafana glob {1,2})
-    instansi_ids = []
-    if instansi_id:
-        clean_instansi = instansi_id.replace('{', '').replace('}', '')
-        instansi_ids = [int(x.strip()) for x in clean_instansi.split(',') if x.strip().isdigit()]
+    instansi_ids = _parse_int_list(instansi_id)
 
     # Parse unit_kerja_id (handle $__all and multi-value with Grafana glob {1,2})
-    unit_kerja_ids = []
-    if unit_kerja_id:
-        clean_uk = unit_kerja_id.replace('{', '').replace('}', '')
-        unit_kerja_ids = [int(x.strip()) for x in clean_uk.split(',') if x.strip().isdigit()]
+    unit_kerja_ids = _parse_int_list(unit_kerja_id)
     
     # Parse months filter
-    month_filter = None
-    if months:
-        clean_months = months.replace('{', '').replace('}', '')
-        month_filter = [int(m.strip()) for m in clean_months.split(',') if m.strip().isdigit()]
+    month_filter = _parse_int_list(months)
     
-    table_id_list = [int(t.strip()) for t in table_ids.split(',')]
+    table_id_list = _parse_int_list(table_ids)
     
-    with get_db_context() as db:
-        combined_data = {}  # bulan -> {data}
-        all_columns = []
-        
-        for table_id in table_id_list:
-            table = db.query(TableDefinition).options(
-                joinedload(TableDefinition.columns)
-            ).filter(TableDefinition.id == table_id).first()
-            
-            if not table:
-                continue
-            
-            safe_table_name = table.name.replace('-', '_').replace(' ', '_')
-            table_display = table.display_name if use_display_name else table.name
-            
-            # Build column mapping
-            col_mapping = {c.name: c.display_name for c in table.columns}
-            summable_cols = [c.name for c in table.columns if c.is_summable]
-            
-            sum_expressions = [f"COALESCE(SUM(t.{col}), 0) as `{col}`" for col in summable_cols]
-            
-            # Build WHERE conditions
-            where_conditions = []
-            params = {}
-            
-            # Year condition (skip if All years)
-            if year_list:
-                if len(year_list) == 1:
-                    where_conditions.append("YEAR(t.tanggal) = :year")
-                    params["year"] = year_list[0]
-                else:
-                    where_conditions.append(f"YEAR(t.tanggal) IN ({','.join(str(y) for y in year_list)})")
-            
-            if month_filter:
-                where_conditions.append(f"MONTH(t.tanggal) IN ({','.join(str(m) for m in month_filter)})")
-            
-            if instansi_ids:
-                if len(instansi_ids) == 1:
-                    where_conditions.append("u.instansi_id = :instansi_id")
-                    params["instansi_id"] = instansi_ids[0]
-                else:
-                    where_conditions.append(f"u.instansi_id IN ({','.join(str(i) for i in instansi_ids)})")
-            
-            if unit_kerja_ids:
-                if len(unit_kerja_ids) == 1:
-                    where_conditions.append("t.unit_kerja_id = :unit_kerja_id")
-                    params["unit_kerja_id"] = unit_kerja_ids[0]
-                else:
-                    where_conditions.append(f"t.unit_kerja_id IN ({','.join(str(u) for u in unit_kerja_ids)})")
-            
-            where_clause = f"WHERE {' AND '.join(where_conditions)}" if where_conditions else ""
-
-            sql = f"""
-                SELECT 
-                    MONTH(t.tanggal) as bulan,
-                    MONTHNAME(t.tanggal) as nama_bulan,
-                    {', '.join(sum_expressions)}
-                FROM {safe_table_name} t
-                LEFT JOIN unit_kerja u ON t.unit_kerja_id = u.id
-                {where_clause}
-                GROUP BY MONTH(t.tanggal), MONTHNAME(t.tanggal)
-            """
-            
-            try:
-                result = db.execute(text(sql), params).mappings().all()
-            except Exception:
-                continue
-            
-            for row in result:
-                row_dict = dict(row)
-                bulan = row_dict['bulan']
-                
-                if bulan not in combined_data:
-                    if use_display_name:
-                        combined_data[bulan] = {'Bulan': bulan, 'Nama Bulan': row_dict['nama_bulan']}
-                    else:
-                        combined_data[bulan] = {'bulan': bulan, 'nama_bulan': row_dict['nama_bulan']}
-                
-                # Add columns with table prefix
-                for col in summable_cols:
-                    if use_display_name:
-                        col_label = f"{table_display} - {col_mapping.get(col, col)}"
-                    else:
-                        col_label = f"{table.name}_{col}"
-                    
-                    combined_data[bulan][col_label] = row_dict.get(col, 0)
-                    
-                    if col_label not in all_columns:
-                        all_columns.append(col_label)
-        
-        # Fill missing months
-        month_names = ['', 'Januari', 'Februari', 'Maret', 'April', 'Mei', 'Juni',
-                       'Juli', 'Agustus', 'September', 'Oktober', 'November', 'Desember']
-        
-        for m in range(1, 13):
-            if m not in combined_data:
-                if use_display_name:
-                    combined_data[m] = {'Bulan': m, 'Nama Bulan': month_names[m]}
-                else:
-                    combined_data[m] = {'bulan': m, 'nama_bulan': month_names[m]}
-                
-                for col in all_columns:
-                    combined_data[m][col] = 0
+    # Table metadata comes from the in-process cache, not a query per request
+    tables = [meta for meta in map(table_service.get_table_meta, dict.fromkeys(table_id_list)) if meta]
+    
+    combined_data = {}  # bulan -> (nama_bulan, values in all_columns order)
+    
+    # Build WHERE conditions (identical for every table)
+    join_clause, where_clause, params = _build_filters(year_list, month_filter, instansi_ids, unit_kerja_ids)
+    
+    # Every output column gets a positional slot (c0, c1, ...) shared by all branches of the
+    # UNION ALL; a branch sums the slots of its own table and selects 0 for the others.
+    slots = []  # (alias, table index, source column, output label)
+    for idx, table in enumerate(tables):
+        table_display = table.display_name if use_display_name else table.name
+        col_mapping = table.col_mapping
+        for col in table.summable_cols:
+            if use_display_name:
+                col_label = f"{table_display} - {col_mapping.get(col, col)}"
             else:
-                # Ensure all columns exist for existing months
-                for col in all_columns:
-                    if col not in combined_data[m]:
-                        combined_data[m][col] = 0
-        
-        combined_list = list(combined_data.values())
-        combined_list.sort(key=lambda x: x.get('Bulan') or x.get('bulan'))
-        
-        # Cache Result (5 minutes)
-        cache.set(cache_key, combined_list, ttl=300)
-        return combined_list
+                col_label = f"{table.name}_{col}"
+            slots.append((f"c{len(slots)}", idx, col, col_label))
+    
+    all_columns = list(dict.fromkeys(label for _, _, _, label in slots))
+    column_index = {label: i for i, label in enumerate(all_columns)}
+    # Per table: (result position, output column index); rows are (bulan, nama_bulan, tid, c0, c1, ...)
+    table_slots = [
+        [(3 + position, column_index[label]) for position, (_, owner, _, label) in enumerate(slots) if owner == idx]
+        for idx in range(len(tables))
+    ]
+    
+    subqueries = []
+    for idx, table in enumerate(tables):
+        safe_table_name = table.safe_name
+        slot_expressions = [
+            f"COALESCE(SUM(t.{col}), 0) as {alias}" if owner == idx else f"0 as {alias}"
+            for alias, owner, col, _ in slots
+        ]
+        subqueries.append(f"""
+            SELECT 
+                {idx} as tid,
+                MONTH(t.tanggal) as bulan{''.join(f', {e}' for e in slot_expressions)}
+            FROM {safe_table_name} t
+            {join_clause}
+            {where_clause}
+            GROUP BY MONTH(t.tanggal)
+        """)
+    
+    # Month spine LEFT JOINed to the aggregates: every requested month comes back,
+    # in order, even when no table has data for it
+    months_to_fill = [m for m in (month_filter or range(1, 13)) if 1 <= m <= 12]
+    slot_columns = ''.join(f', a.{alias}' for alias, _, _, _ in slots)
+    
+    def with_month_spine(aggregate_sql: str) -> str:
+        return f"""
+            SELECT 
+                m.month as bulan,
+                MONTHNAME(CONCAT('2000-', LPAD(m.month, 2, '0'), '-01')) as nama_bulan,
+                a.tid{slot_columns}
+            FROM ({_int_series('month', months_to_fill)}) m
+            LEFT JOIN ({aggregate_sql}) a ON a.bulan = m.month
+            ORDER BY m.month, a.tid
+        """
+    
+    # One round-trip for all tables
+    rows = []
+    if months_to_fill:
+        try:
+            union_sql = " UNION ALL ".join(subqueries) or "SELECT NULL as tid, NULL as bulan"
+            with get_db_context() as db:
+                rows = db.execute(_stmt(with_month_spine(union_sql), params), params).all()
+        except Exception:
+            logger.warning("Combined query failed for tables %s, retrying per table", table_id_list, exc_info=True)
+            # A broken table must not blank the whole panel: retry per table (concurrently,
+            # one session each, the combined query's connection already returned) and skip failures
+            with ThreadPoolExecutor(max_workers=min(COMBINED_FALLBACK_WORKERS, len(subqueries)) or 1) as pool:
+                for table_rows in pool.map(lambda sql: _fetch_rows_or_empty(with_month_spine(sql), params), subqueries):
+                    rows.extend(table_rows)
+    
+    bulan_key, nama_bulan_key = ('Bulan', 'Nama Bulan') if use_display_name else ('bulan', 'nama_bulan')
+    
+    # Dense buffer: one zeroed value list per month, written by column index;
+    # dicts are only built once at the end (rows already arrive in month order)
+    for row in rows:
+        bulan, nama_bulan, tid = row[0], row[1], row[2]
+        
+        month_row = combined_data.get(bulan)
+        if month_row is None:
+            month_row = combined_data[bulan] = (nama_bulan, [0] * len(all_columns))
+        
+        # tid is NULL for months without data
+        if tid is not None:
+            values = month_row[1]
+            for position, column in table_slots[tid]:
+                values[column] = int(row[position])
+    
+    combined_list = [
+        {bulan_key: bulan, nama_bulan_key: nama_bulan, **dict(zip(all_columns, values))}
+        for bulan, (nama_bulan, values) in combined_data.items()
+    ]
+    
+    cache.set(cache_key, combined_list, ttl=settings.grafana_cache_ttl)
+    return ORJSONResponse(combined_list)
 
 
 @router.get("/grafana/geo")
@@ -635,42 +710,35 @@ def get_grafana_geo(
     
     Setiap row = 1 instansi dengan latitude, longitude, nama, dan data statistik.
     """
-    cache_key = f"grafana:geo:{table_id}:{year}:{columns}:{months}:{include_total_col}"
+    cache_key = _grafana_cache_key(
+        "geo", table_id, year, columns, months, use_display_name, include_total_col, table_ids=(table_id,)
+    )
     cached_data = cache.get(cache_key)
-    if cached_data:
-        return cached_data
+    if cached_data is not None:
+        return ORJSONResponse(cached_data)
 
     # Parse year
     year_list = []
     is_all_years = False
     if year:
-        clean_year_str = str(year).replace('{', '').replace('}', '').strip()
-        if clean_year_str.lower() in ('all', '$__all', ''):
+        if year.strip('{} ').lower() in ('all', '$__all', ''):
             is_all_years = True
         else:
-            raw_years = [int(y.strip()) for y in clean_year_str.split(',') if y.strip().isdigit()]
-            year_list = sorted(list(set(raw_years)), reverse=True)
+            year_list = sorted(set(_parse_int_list(year)), reverse=True)
     if not year_list and not is_all_years:
         year_list = [datetime.now().year]
 
     # Parse months
-    month_filter = None
-    if months:
-        clean_months = months.replace('{', '').replace('}', '')
-        month_filter = [int(m.strip()) for m in clean_months.split(',') if m.strip().isdigit()]
+    month_filter = _parse_int_list(months)
 
+    table = table_service.get_table_meta(table_id)
+    if not table:
+        return []
+    
     with get_db_context() as db:
-        table = db.query(TableDefinition).options(
-            joinedload(TableDefinition.columns)
-        ).filter(TableDefinition.id == table_id).first()
-        
-        if not table:
-            return []
-        
         # Build column mapping
-        col_mapping = {c.name: c.display_name for c in table.columns}
-        col_mapping["total"] = "Total"
-        available_cols = [c.name for c in table.columns if c.is_summable]
+        col_mapping = {**table.col_mapping, "total": "Total"}
+        available_cols = list(table.summable_cols)
         if "total" not in available_cols:
             available_cols.append("total")
         
@@ -689,39 +757,15 @@ def get_grafana_geo(
             if "total" in selected_cols:
                 selected_cols.remove("total")
         
-        sum_expressions = [f"COALESCE(SUM(t.{col}), 0) as `{col}`" for col in selected_cols]
-        
-        # Use summary table if available
-        from app.services.generic_summary_service import GenericSummaryService
-        summary_service = GenericSummaryService(db)
-        has_summary = summary_service.check_summary_exists(table.id)
-        use_summary = has_summary
-        
-        if use_summary:
-            safe_table_name = summary_service.get_summary_table_name(table.id)
-        else:
-            safe_table_name = table.name.replace('-', '_').replace(' ', '_')
-        
-        # Build WHERE
-        where_conditions = []
-        params = {}
-        
-        if year_list:
-            col_year = "t.year" if use_summary else "YEAR(t.tanggal)"
-            if len(year_list) == 1:
-                where_conditions.append(f"{col_year} = :year")
-                params["year"] = year_list[0]
-            else:
-                where_conditions.append(f"{col_year} IN ({','.join(str(y) for y in year_list)})")
+        sum_expressions = [table.sum_sql[col] for col in selected_cols]
         
-        if month_filter:
-            if use_summary:
-                months_padded = [f"'{m:02d}'" for m in month_filter]
-                where_conditions.append(f"SUBSTRING(t.month, 6, 2) IN ({','.join(months_padded)})")
-            else:
-                where_conditions.append(f"MONTH(t.tanggal) IN ({','.join(str(m) for m in month_filter)})")
+        # Use summary table if available (and it has every selected column)
+        summary_table = table.summary_for(selected_cols)
+        use_summary = summary_table is not None
+        safe_table_name = summary_table or table.safe_name
         
-        where_clause = f"WHERE {' AND '.join(where_conditions)}" if where_conditions else ""
+        # Build WHERE (geo has its own unit_kerja/instansi joins)
+        _, where_clause, params = _build_filters(year_list, month_filter, use_summary=use_summary)
         
         # SQL: Group by instansi, include lat/lng from instansi table
         sql = f"""
@@ -740,27 +784,27 @@ def get_grafana_geo(
         """
         
         try:
-            result = db.execute(text(sql), params).mappings().all()
-        except Exception as e:
-            print(f"GEO ENDPOINT ERROR: {e}")
+            # Plain tuples in SELECT order: instansi_id, instansi_nama, latitude, longitude, then selected_cols
+            result = db.execute(_stmt(sql, params), params).all()
+        except Exception:
+            logger.exception("Grafana geo query failed for table %s", table_id)
             return []
         
-        geo_data = []
-        for row in result:
-            row_dict = dict(row)
-            geo_row = {
-                "latitude": row_dict.get("latitude"),
-                "longitude": row_dict.get("longitude"),
-                "instansi": row_dict.get("instansi_nama", "Unknown"),
+        # Output key per data column, resolved once instead of per row
+        if use_display_name:
+            value_keys = [col_mapping.get(col, col) for col in selected_cols]
+        else:
+            value_keys = selected_cols
+        
+        geo_data = [
+            {
+                "latitude": latitude,
+                "longitude": longitude,
+                "instansi": instansi_nama,
+                **dict(zip(value_keys, map(int, values)))
             }
-            # Add data columns
-            for col in selected_cols:
-                if use_display_name:
-                    display = col_mapping.get(col, col)
-                    geo_row[display] = row_dict.get(col, 0)
-                else:
-                    geo_row[col] = row_dict.get(col, 0)
-            geo_data.append(geo_row)
+            for _, instansi_nama, latitude, longitude, *values in result
+        ]
         
         # Filter out rows without valid coordinates
         geo_data_valid = [r for r in geo_data if r.get("latitude") is not None and r.get("longitude") is not None]
@@ -768,39 +812,55 @@ def get_grafana_geo(
         # If no valid geo data, return all (user may want to see data without map)
         final_data = geo_data_valid if geo_data_valid else geo_data
         
-        cache.set(cache_key, final_data, ttl=300)
-        return final_data
+        cache.set(cache_key, final_data, ttl=settings.grafana_cache_ttl)
+        return ORJSONResponse(final_data)
 
 
 @router.get("/grafana/var/tahun")
-def get_grafana_var_tahun():
+def get_grafana_var_tahun(request: Request):
     """
     [GRAFANA VARIABLE] Daftar tahun untuk variable dropdown.
     Mengambil tahun yang tersedia dari database.
     """
+    cache_key = _grafana_cache_key("var_tahun", all_tables=True)
+    cached_data = cache.get(cache_key)
+    if cached_data is not None:
+        return _etag_response(cached_data, request)
+
     years = set()
     try:
         with get_db_context() as db:
-            tables = db.query(TableDefinition).all()
-            for t in tables:
-                safe_name = t.name.replace("-", "_").replace(" ", "_")
+            table_ids = [tid for (tid,) in db.query(TableDefinition.id).all()]
+            subqueries = [
+                f"SELECT DISTINCT YEAR(tanggal) AS y FROM {meta.safe_name} WHERE tanggal IS NOT NULL"
+                for meta in map(table_service.get_table_meta, table_ids) if meta
+            ]
+            if subqueries:
                 try:
-                    # Get distinct years from each table
-                    sql = f"SELECT DISTINCT YEAR(tanggal) FROM {safe_name} WHERE tanggal IS NOT NULL"
-                    result = db.execute(text(sql)).fetchall()
-                    for r in result:
-                        if r[0]:
-                            years.add(int(r[0]))
+                    # All tables in one round-trip; UNION also de-duplicates the years
+                    rows = db.execute(text(" UNION ".join(subqueries))).all()
                 except Exception:
-                    continue
-    except Exception as e:
-        print(f"Error fetching years: {e}")
+                    # A table without tanggal must not drop every year: retry per table and skip failures
+                    rows = []
+                    for sql in subqueries:
+                        try:
+                            rows.extend(db.execute(text(sql)).all())
+                        except Exception:
+                            logger.warning("Year lookup failed for one table, skipping it", exc_info=True)
+                            continue
+                years = {int(y) for (y,) in rows if y}
+    except Exception:
+        logger.exception("Error fetching years, falling back to a default range")
         # Fallback if DB query fails
         current_year = datetime.now().year
         years = set(range(current_year - 2, current_year + 2))
+        cache_key = None  # Don't pin the fallback; retry the DB on the next request
     
-    sorted_years = sorted(list(years), reverse=True)
-    return [{"text": str(y), "value": str(y), "__text": str(y), "__value": str(y)} for y in sorted_years]
+    sorted_years = sorted(years, reverse=True)
+    year_data = [{"text": str(y), "value": str(y), "__text": str(y), "__value": str(y)} for y in sorted_years]
+    if cache_key:
+        cache.set(cache_key, year_data, ttl=VAR_CACHE_TTL)
+    return _etag_response(year_data, request)
 
 
 
@@ -813,43 +873,29 @@ def get_grafana_yearly(
     """
     [GRAFANA OPTIMIZED] Perbandingan tahunan - Response langsung array.
     """
-    # 1. Try Cache (v2)
-    cache_key = f"grafana:v2:yearly:{table_id}:{years}"
+    # 1. Try Cache
+    cache_key = _grafana_cache_key("grafana_yearly", table_id, years, table_ids=(table_id,))
     cached_data = cache.get(cache_key)
-    if cached_data:
-        return cached_data
+    if cached_data is not None:
+        return ORJSONResponse(cached_data)
 
-    year_list = [int(y.strip()) for y in years.split(',')]
+    year_list = _parse_int_list(years)
+    
+    table = table_service.get_table_meta(table_id)
+    if not table:
+        return []
     
     with get_db_context() as db:
-        table = db.query(TableDefinition).options(
-            joinedload(TableDefinition.columns)
-        ).filter(TableDefinition.id == table_id).first()
-        
-        if not table:
-            return []
-        
-        safe_table_name = table.name.replace('-', '_').replace(' ', '_')
-        available_cols = [c.name for c in table.columns if c.is_summable]
-        
-        sum_expressions = [f"COALESCE(SUM({col}), 0) as {col}" for col in available_cols]
-        sum_expressions.append("COALESCE(SUM(total), 0) as total")
-        
-        sql = f"""
-            SELECT 
-                YEAR(tanggal) as tahun,
-                {', '.join(sum_expressions)}
-            FROM {safe_table_name}
-            WHERE YEAR(tanggal) IN :years
-            GROUP BY YEAR(tanggal)
-            ORDER BY tahun
-        """
+        # Every summable column + 'total' (folded in once, even if it is itself summable)
+        params = {}
+        sql = _yearly_sql(table, tuple(table.sum_sql), year_list, params)
         
         try:
-            result = db.execute(text(sql), {"years": tuple(year_list)}).mappings().all()
-            final_data = [dict(row) for row in result]
-            cache.set(cache_key, final_data, ttl=300)
-            return final_data
+            result = db.execute(_stmt(sql, params), params).mappings().all()
+            # Plain ints (SUM yields Decimal) so orjson can serialize them directly
+            final_data = [{key: int(value or 0) for key, value in row.items()} for row in result]
+            cache.set(cache_key, final_data, ttl=settings.grafana_cache_ttl)
+            return ORJSONResponse(final_data)
         except Exception:
             return []
 
@@ -879,20 +925,15 @@ def get_monthly_stats(
     if year is None:
         year = datetime.now().year
     
+    table = table_service.get_table_meta(table_id)
+    if not table:
+        raise HTTPException(status_code=404, detail="Tabel tidak ditemukan")
+    
     with get_db_context() as db:
-        # 1. Get table definition
-        table = db.query(TableDefinition).options(
-            joinedload(TableDefinition.columns)
-        ).filter(TableDefinition.id == table_id).first()
-        
-        if not table:
-            raise HTTPException(status_code=404, detail="Tabel tidak ditemukan")
-        
-        # Sanitize table name
-        safe_table_name = table.name.replace('-', '_').replace(' ', '_')
+        safe_table_name = table.safe_name
         
         # 2. Determine columns to aggregate
-        available_cols = [c.name for c in table.columns if c.is_summable]
+        available_cols = list(table.summable_cols)
         
         if columns:
             requested_cols = [c.strip() for c in columns.split(',')]
@@ -907,62 +948,52 @@ def get_monthly_stats(
             selected_cols = available_cols
         
         # 3. Build SQL query
-        sum_expressions = [f"COALESCE(SUM(t.{col}), 0) as {col}" for col in selected_cols]
-        sum_expressions.append("COALESCE(SUM(t.total), 0) as total")
+        sum_expressions = [table.sum_sql[col] for col in dict.fromkeys([*selected_cols, "total"])]
+        
+        # Same filter builder as /grafana/monthly (single year, optional instansi)
+        join_clause, where_clause, params = _build_filters([year], None, [instansi_id] if instansi_id else [])
         
         sql = f"""
             SELECT 
                 MONTH(t.tanggal) as bulan,
-                MONTHNAME(t.tanggal) as nama_bulan,
+                MONTHNAME(MIN(t.tanggal)) as nama_bulan,
                 {', '.join(sum_expressions)}
             FROM {safe_table_name} t
-            JOIN unit_kerja u ON t.unit_kerja_id = u.id
-            WHERE YEAR(t.tanggal) = :year
-        """
-        
-        params = {"year": year}
-        
-        if instansi_id:
-            sql += " AND u.instansi_id = :instansi_id"
-            params["instansi_id"] = instansi_id
-        
-        sql += """
-            GROUP BY MONTH(t.tanggal), MONTHNAME(t.tanggal)
+            {join_clause}
+            {where_clause}
+            GROUP BY MONTH(t.tanggal)
             ORDER BY bulan
         """
         
         try:
-            result = db.execute(text(sql), params).mappings().all()
+            result = db.execute(_stmt(sql, params), params).mappings().all()
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Query error: {str(e)}")
         
-        # 4. Format response for Grafana
-        monthly_data = []
+        # 4. Format response for Grafana: one slot per month (1..12), missing months get zeros
+        sum_cols = list(dict.fromkeys([*selected_cols, "total"]))
+        month_slots = [None] * 13
         for row in result:
-            row_dict = dict(row)
-            monthly_data.append(row_dict)
-        
-        # Fill missing months with zeros
-        existing_months = {d['bulan'] for d in monthly_data}
-        month_names = ['', 'January', 'February', 'March', 'April', 'May', 'June',
-                       'July', 'August', 'September', 'October', 'November', 'December']
-        
-        for m in range(1, 13):
-            if m not in existing_months:
-                zero_row = {'bulan': m, 'nama_bulan': month_names[m], 'total': 0}
-                for col in selected_cols:
-                    zero_row[col] = 0
-                monthly_data.append(zero_row)
+            # Plain ints (SUM yields Decimal) so orjson can serialize them directly
+            month_slots[row['bulan']] = {
+                'bulan': row['bulan'],
+                'nama_bulan': row['nama_bulan'],
+                **{col: int(row[col] or 0) for col in sum_cols}
+            }
         
-        monthly_data.sort(key=lambda x: x['bulan'])
+        zero_values = {'total': 0, **dict.fromkeys(selected_cols, 0)}
+        monthly_data = [
+            month_slots[m] or {'bulan': m, 'nama_bulan': MONTH_NAMES_EN[m], **zero_values}
+            for m in range(1, 13)
+        ]
         
-        return {
+        return ORJSONResponse({
             "table_id": table_id,
             "table_name": table.display_name,
             "year": year,
             "columns": selected_cols,
             "data": monthly_data
-        }
+        })
 
 
 @router.get("/columns")
@@ -973,69 +1004,82 @@ def get_available_columns(
     Ambil daftar kolom yang tersedia untuk tabel tertentu.
     Berguna untuk dropdown filter di Grafana.
     """
-    with get_db_context() as db:
-        table = db.query(TableDefinition).options(
-            joinedload(TableDefinition.columns)
-        ).filter(TableDefinition.id == table_id).first()
-        
-        if not table:
-            raise HTTPException(status_code=404, detail="Tabel tidak ditemukan")
-        
-        columns = [
-            {
-                "name": c.name,
-                "display_name": c.display_name,
-                "data_type": c.data_type,
-                "is_summable": c.is_summable
-            }
-            for c in table.columns
-        ]
-        
-        return {
-            "table_id": table_id,
-            "table_name": table.display_name,
-            "columns": columns
+    table = table_service.get_table_meta(table_id)
+    if not table:
+        raise HTTPException(status_code=404, detail="Tabel tidak ditemukan")
+    
+    columns = [
+        {
+            "name": c["name"],
+            "display_name": c["display_name"],
+            "data_type": c["data_type"],
+            "is_summable": c["is_summable"]
         }
+        for c in table.columns
+    ]
+    
+    return ORJSONResponse({
+        "table_id": table_id,
+        "table_name": table.display_name,
+        "columns": columns
+    })
 
 
 @router.get("/tables")
-def get_available_tables():
+def get_available_tables(request: Request):
     """
     Ambil daftar tabel yang tersedia.
     Berguna untuk dropdown filter di Grafana.
     """
+    cache_key = _grafana_cache_key("tables")
+    cached_data = cache.get(cache_key)
+    if cached_data is not None:
+        return _etag_response(cached_data, request)
+    
     with get_db_context() as db:
-        tables = db.query(TableDefinition).all()
-        
-        return {
-            "tables": [
-                {
-                    "id": t.id,
-                    "name": t.name,
-                    "display_name": t.display_name,
-                    "is_default": t.is_default
-                }
-                for t in tables
-            ]
-        }
+        result = db.query(
+            TableDefinition.id, TableDefinition.name, TableDefinition.display_name, TableDefinition.is_default
+        ).all()
+    
+    tables_data = {
+        "tables": [
+            {
+                "id": id_,
+                "name": name,
+                "display_name": display_name,
+                "is_default": is_default
+            }
+            for id_, name, display_name, is_default in result
+        ]
+    }
+    cache.set(cache_key, tables_data, ttl=VAR_CACHE_TTL)
+    return _etag_response(tables_data, request)
 
 
 @router.get("/instansi")
-def get_available_instansi():
+def get_available_instansi(request: Request):
     """
     Ambil daftar instansi yang tersedia.
     Berguna untuk dropdown filter di Grafana.
     """
+    cache_key = _grafana_cache_key("instansi")
+    cached_data = cache.get(cache_key)
+    if cached_data is not None:
+        return _etag_response(cached_data, request)
+    
     with get_db_context() as db:
-        result = db.execute(text("SELECT id, kode, nama FROM instansi ORDER BY nama")).mappings().all()
-        
-        return {
-            "instansi": [dict(row) for row in result]
-        }
+        result = db.execute(SQL_INSTANSI_LIST).all()
+    
+    instansi_data = {
+        "instansi": [{"id": id_, "kode": kode, "nama": nama} for id_, kode, nama in result]
+    }
+    cache.set(cache_key, instansi_data, ttl=VAR_CACHE_TTL)
+    return _etag_response(instansi_data, request)
 
 
 @router.get("/unit-kerja")
 def get_available_unit_kerja(
+    request: Request,
     instansi_id: Optional[int] = Query(None, description="Filter berdasarkan instansi ID (untuk chained variable)")
 ):
     """
@@ -1043,142 +1087,138 @@ def get_available_unit_kerja(
     Berguna untuk dropdown variable di Grafana.
     Mendukung chained variable: pilih instansi -> unit kerja ikut berubah.
     """
+    cache_key = _grafana_cache_key("unit_kerja", instansi_id)
+    cached_data = cache.get(cache_key)
+    if cached_data is not None:
+        return _etag_response(cached_data, request)
+    
     with get_db_context() as db:
         if instansi_id:
             result = db.execute(
-                text("SELECT id, kode, nama, instansi_id FROM unit_kerja WHERE instansi_id = :instansi_id ORDER BY nama"),
+                SQL_UNIT_KERJA_BY_INSTANSI,
                 {"instansi_id": instansi_id}
             ).mappings().all()
         else:
-            result = db.execute(
-                text("SELECT u.id, u.kode, u.nama, u.instansi_id, i.nama as instansi_nama FROM unit_kerja u LEFT JOIN instansi i ON u.instansi_id = i.id ORDER BY i.nama, u.nama")
-            ).mappings().all()
-        
-        return {
-            "unit_kerja": [dict(row) for row in result]
-        }
+            result = db.execute(SQL_UNIT_KERJA_LIST).mappings().all()
+    
+    unit_kerja_data = {
+        "unit_kerja": [dict(row) for row in result]
+    }
+    cache.set(cache_key, unit_kerja_data, ttl=VAR_CACHE_TTL)
+    return _etag_response(unit_kerja_data, request)
 
 
 @router.get("/months")
-def get_available_months():
+def get_available_months(request: Request):
     """
     Daftar 12 bulan untuk variable dropdown di Grafana.
     """
-    return {
-        "months": [
-            {"id": 1, "name": "Januari"},
-            {"id": 2, "name": "Februari"},
-            {"id": 3, "name": "Maret"},
-            {"id": 4, "name": "April"},
-            {"id": 5, "name": "Mei"},
-            {"id": 6, "name": "Juni"},
-            {"id": 7, "name": "Juli"},
-            {"id": 8, "name": "Agustus"},
-            {"id": 9, "name": "September"},
-            {"id": 10, "name": "Oktober"},
-            {"id": 11, "name": "November"},
-            {"id": 12, "name": "Desember"}
-        ]
-    }
+    return _etag_response({
+        "months": [{"id": m, "name": MONTH_NAMES[m]} for m in range(1, 13)]
+    }, request)
 
 
 # ============================================
 # GRAFANA VARIABLE ENDPOINTS (flat __text/__value format)
 # ============================================
 
+def _var_option(label: str, value: str) -> dict:
+    """One Grafana variable option, keyed for both the standard and the legacy (__) format"""
+    return {"text": label, "value": value, "__text": label, "__value": value}
+
+
+def _load_var_instansi(cache_key: str) -> list:
+    """Query and cache the instansi dropdown list"""
+    # Options are built straight off the cursor: no intermediate list of rows
+    with get_db_context() as db:
+        instansi_vars = [_var_option(nama, sid) for sid, nama in db.execute(SQL_VAR_INSTANSI)]
+    cache.set(cache_key, instansi_vars, ttl=VAR_CACHE_TTL)
+    return instansi_vars
+
+
+def _load_var_unit_kerja(cache_key: str, instansi_ids: List[int]) -> list:
+    """Query and cache the unit kerja dropdown list (all units when instansi_ids is empty)"""
+    with get_db_context() as db:
+        if instansi_ids:
+            # Expanding bind: one statement text for any number of selected instansi
+            result = db.execute(SQL_VAR_UNIT_KERJA_IN, {"instansi_ids": instansi_ids})
+        else:
+            result = db.execute(SQL_VAR_UNIT_KERJA_ALL)
+        unit_kerja_vars = [_var_option(label, sid) for sid, label in result]
+    
+    cache.set(cache_key, unit_kerja_vars, ttl=VAR_CACHE_TTL)
+    return unit_kerja_vars
+
+
+def warm_grafana_var_cache() -> None:
+    """Prefill the unfiltered dropdown lists Grafana requests first on every dashboard load"""
+    try:
+        _load_var_instansi(_grafana_cache_key("var_instansi"))
+        _load_var_unit_kerja(_grafana_cache_key("var_unit_kerja", ()), [])
+        logger.info("Grafana variable lists warmed")
+    except Exception:
+        logger.warning("Grafana variable warm-up skipped", exc_info=True)
+
+
 @router.get("/grafana/var/instansi")
-def get_grafana_var_instansi():
+def get_grafana_var_instansi(request: Request):
     """
     [GRAFANA VARIABLE] Universal Format.
     Returns keys for both standard (text/value) and legacy (__text/__value).
     """
-    # DEBUG LOGGING
-    try:
-        with open("d:/splp-integrator/debug_vars.log", "a") as f:
-            f.write(f"[{datetime.now()}] Instansi Request\n")
-    except Exception as e:
-        print(f"Log Error: {e}")
+    logger.debug("Grafana var instansi request")
 
-    with get_db_context() as db:
-        result = db.execute(text("SELECT id, nama FROM instansi ORDER BY nama")).mappings().all()
-        return [{
-            "text": row["nama"], 
-            "value": str(row["id"]),
-            "__text": row["nama"],
-            "__value": str(row["id"])
-        } for row in result]
+    cache_key = _grafana_cache_key("var_instansi")
+    instansi_vars = cache.get(cache_key)
+    if instansi_vars is None:
+        instansi_vars = _load_var_instansi(cache_key)
+    return _etag_response(instansi_vars, request)
 
 
 @router.get("/grafana/var/unit-kerja")
 def get_grafana_var_unit_kerja(
+    request: Request,
     instansi_id: Optional[str] = Query(None, description="Filter instansi (support $__all)")
 ):
     """
     [GRAFANA VARIABLE] Universal Format.
     """
-    # DEBUG LOGGING
-    try:
-        with open("d:/splp-integrator/debug_vars.log", "a") as f:
-            f.write(f"[{datetime.now()}] UnitKerja Request - instansi_id: '{instansi_id}'\n")
-    except Exception as e:
-        print(f"Log Error: {e}")
+    logger.debug("Grafana var unit kerja request - instansi_id: %r", instansi_id)
 
     instansi_ids = []
-    if instansi_id:
-        clean_ids = instansi_id.replace('{', '').replace('}', '')
-        if clean_ids.lower() != 'all' and '$__all' not in clean_ids:
-             instansi_ids = [int(x.strip()) for x in clean_ids.split(',') if x.strip().isdigit()]
+    if instansi_id and instansi_id.strip('{} ').lower() != 'all' and '$__all' not in instansi_id:
+        # Sorted and deduped: the result does not depend on selection order, so neither does the key
+        instansi_ids = sorted(set(_parse_int_list(instansi_id)))
     
-    with get_db_context() as db:
-        if instansi_ids:
-            if len(instansi_ids) == 1:
-                result = db.execute(
-                    text("SELECT id, nama FROM unit_kerja WHERE instansi_id = :iid ORDER BY nama"),
-                    {"iid": instansi_ids[0]}
-                ).mappings().all()
-            else:
-                result = db.execute(
-                    text(f"SELECT id, nama FROM unit_kerja WHERE instansi_id IN ({','.join(str(i) for i in instansi_ids)}) ORDER BY nama")
-                ).mappings().all()
-        else:
-            result = db.execute(
-                text("SELECT u.id, u.nama, i.nama as instansi_nama FROM unit_kerja u LEFT JOIN instansi i ON u.instansi_id = i.id ORDER BY i.nama, u.nama")
-            ).mappings().all()
-        
-        return [
-            {
-                "text": f"{row['nama']} ({row.get('instansi_nama', '')})" if row.get('instansi_nama') else row['nama'],
-                "value": str(row["id"]),
-                "__text": f"{row['nama']} ({row.get('instansi_nama', '')})" if row.get('instansi_nama') else row['nama'],
-                "__value": str(row["id"])
-            }
-            for row in result
-        ]
+    # Keyed on the parsed ids: "1,2", "{2,1}" and "$__all" variants share entries
+    cache_key = _grafana_cache_key("var_unit_kerja", tuple(instansi_ids))
+    unit_kerja_vars = cache.get(cache_key)
+    if unit_kerja_vars is None:
+        unit_kerja_vars = _load_var_unit_kerja(cache_key, instansi_ids)
+    return _etag_response(unit_kerja_vars, request)
+
+
+# Month dropdown never changes: serialized and hashed once at import
+BULAN_VAR_JSON = orjson.dumps([_var_option(MONTH_NAMES[m], str(m)) for m in range(1, 13)])
+BULAN_VAR_HEADERS = {
+    "ETag": f'"{hashlib.blake2b(BULAN_VAR_JSON, digest_size=16).hexdigest()}"',
+    "Cache-Control": "public, max-age=86400",
+}
 
 
 @router.get("/grafana/var/bulan")
-def get_grafana_var_bulan():
+async def get_grafana_var_bulan(request: Request):
     """
     [GRAFANA VARIABLE] Universal Format.
     """
-    return [
-        {"text": "Januari", "value": "1", "__text": "Januari", "__value": "1"},
-        {"text": "Februari", "value": "2", "__text": "Februari", "__value": "2"},
-        {"text": "Maret", "value": "3", "__text": "Maret", "__value": "3"},
-        {"text": "April", "value": "4", "__text": "April", "__value": "4"},
-        {"text": "Mei", "value": "5", "__text": "Mei", "__value": "5"},
-        {"text": "Juni", "value": "6", "__text": "Juni", "__value": "6"},
-        {"text": "Juli", "value": "7", "__text": "Juli", "__value": "7"},
-        {"text": "Agustus", "value": "8", "__text": "Agustus", "__value": "8"},
-        {"text": "September", "value": "9", "__text": "September", "__value": "9"},
-        {"text": "Oktober", "value": "10", "__text": "Oktober", "__value": "10"},
-        {"text": "November", "value": "11", "__text": "November", "__value": "11"},
-        {"text": "Desember", "value": "12", "__text": "Desember", "__value": "12"}
-    ]
+    if BULAN_VAR_HEADERS["ETag"] in (tag.strip() for tag in request.headers.get("if-none-match", "").split(",")):
+        return Response(status_code=304, headers=BULAN_VAR_HEADERS)
+    return Response(content=BULAN_VAR_JSON, media_type="application/json", headers=BULAN_VAR_HEADERS)
 
 
 @router.get("/yearly")
 def get_yearly_comparison(
+    background_tasks: BackgroundTasks,
     table_id: int = Query(1, description="ID tabel"),
     years: str = Query(..., description="Tahun yang ingin dibandingkan, pisahkan dengan koma (contoh: 2024,2025)"),
     columns: Optional[str] = Query(None, description="Kolom yang ingin diagregasi")
@@ -1187,49 +1227,53 @@ def get_yearly_comparison(
     Ambil perbandingan statistik tahunan.
     Berguna untuk grafik perbandingan year-over-year di Grafana.
     """
-    # 1. Try Cache
-    cache_key = f"grafana:yearly:{table_id}:{years}"
-    cached_data = cache.get(cache_key)
-    if cached_data:
-        return cached_data
+    # Reject bad parameters before any cache or DB work
+    year_list = _parse_int_list(years)
+    if not year_list:
+        raise HTTPException(status_code=400, detail="Parameter years wajib diisi (contoh: 2024,2025)")
+    
+    table = table_service.get_table_meta(table_id)
+    if not table:
+        raise HTTPException(status_code=404, detail="Tabel tidak ditemukan")
+    
+    available_cols = list(table.summable_cols)
+    if columns:
+        selected_cols = [c.strip() for c in columns.split(',') if c.strip() in available_cols]
+        if not selected_cols:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Kolom tidak valid. Kolom tersedia: {', '.join(available_cols)}"
+            )
+    else:
+        selected_cols = available_cols
+    
+    cache_key = _grafana_cache_key("yearly", table_id, years, columns, table_ids=(table_id,))
+    def build_entry():
+        return {"data": _yearly_comparison_data(table, year_list, selected_cols), "ts": time.time()}
+    
+    entry = cache.get(cache_key)
+    if entry is None:
+        # Panels of one dashboard ask for the same comparison at once: only one of them queries
+        entry = cache.get_or_set(cache_key, build_entry, ttl=YEARLY_STALE_TTL)
+    elif time.time() - entry["ts"] > settings.grafana_cache_ttl:
+        # Stale-while-revalidate: answer from cache now, recompute after the response is sent.
+        # App writes change the key's table version, so a stale entry only misses external edits.
+        background_tasks.add_task(cache.refresh, cache_key, build_entry, YEARLY_STALE_TTL)
+    return ORJSONResponse(entry["data"])
+
 
-    year_list = [int(y.strip()) for y in years.split(',')]
+def _yearly_comparison_data(table, year_list: List[int], selected_cols: List[str]) -> dict:
+    """Build the /yearly response body"""
+    params = {}
+    sql = _yearly_sql(table, tuple(dict.fromkeys([*selected_cols, "total"])), year_list, params)
     
     with get_db_context() as db:
-        table = db.query(TableDefinition).options(
-            joinedload(TableDefinition.columns)
-        ).filter(TableDefinition.id == table_id).first()
-        
-        if not table:
-            raise HTTPException(status_code=404, detail="Tabel tidak ditemukan")
-        
-        safe_table_name = table.name.replace('-', '_').replace(' ', '_')
-        available_cols = [c.name for c in table.columns if c.is_summable]
-        
-        if columns:
-            selected_cols = [c.strip() for c in columns.split(',') if c.strip() in available_cols]
-        else:
-            selected_cols = available_cols
-        
-        sum_expressions = [f"COALESCE(SUM({col}), 0) as {col}" for col in selected_cols]
-        sum_expressions.append("COALESCE(SUM(total), 0) as total")
-        
-        sql = f"""
-            SELECT 
-                YEAR(tanggal) as tahun,
-                {', '.join(sum_expressions)}
-            FROM {safe_table_name}
-            WHERE YEAR(tanggal) IN :years
-            GROUP BY YEAR(tanggal)
-            ORDER BY tahun
-        """
-        
-        result = db.execute(text(sql), {"years": tuple(year_list)}).mappings().all()
-        
-        return {
-            "table_id": table_id,
-            "table_name": table.display_name,
-            "years": year_list,
-            "columns": selected_cols,
-            "data": [dict(row) for row in result]
-        }
+        result = db.execute(_stmt(sql, params), params).mappings().all()
+    
+    return {
+        "table_id": table.id,
+        "table_name": table.display_name,
+        "years": year_list,
+        "columns": selected_cols,
+        "data": [{key: int(value or 0) for key, value in row.items()} for row in result]
+    }
@@ -23,6 +23,11 @@ class Settings:
         # App
         self.app_env: str = os.getenv("APP_ENV", "development")
         self.sync_interval_seconds: int = int(os.getenv("SYNC_INTERVAL_SECONDS", "300"))
+        # Worker threads for sync endpoints (Starlette default is 40); DB work stays bounded by the pool
+        self.threadpool_size: int = int(os.getenv("THREADPOOL_SIZE", "100"))
+        
+        # Cache
+        self.grafana_cache_ttl: int = int(os.getenv("GRAFANA_CACHE_TTL", "60"))
     
     @property
     def database_url(self) -> str:
@@ -47,6 +47,18 @@ def get_db_context():
         db.close()
 
 
+def warm_pool() -> int:
+    """Open the pool's persistent connections up front so first requests skip the MySQL handshake"""
+    connections = []
+    try:
+        for _ in range(engine.pool.size()):
+            connections.append(engine.connect())
+    finally:
+        for conn in connections:
+            conn.close()  # Returned to the pool, not closed
+    return len(connections)
+
+
 def test_connection() -> dict:
     """Test database connection"""
     try:
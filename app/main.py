@@ -5,13 +5,17 @@ Arsip Nasional Republik Indonesia
 """
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse
 from contextlib import asynccontextmanager
+import anyio.to_thread
+import asyncio
 import os
 
 from app.config import get_settings
+from app.database import warm_pool
 from app.api.routes import router
 from app.api.arsip_routes import router as arsip_router
 from app.api.summary_routes import router as summary_router
@@ -19,7 +23,7 @@ from app.api.auth_routes import router as auth_router
 from app.api.data_routes import router as data_router
 from app.api.upload_routes import router as upload_router
 from app.api.table_routes import router as table_router
-from app.api.stats_routes import router as stats_router
+from app.api.stats_routes import router as stats_router, warm_grafana_var_cache
 from app.services.integrator import integrator_service
 from app.services.arsip_service import arsip_service
 from app.services.aggregation_service import aggregation_service
@@ -27,6 +31,16 @@ from app.services.auth_service import auth_service
 
 settings = get_settings()
 
+def warm_up():
+    """Pre-open DB connections and prefill Grafana dropdown caches (runs off the event loop)"""
+    try:
+        print(f"[Database] Connection pool warmed ({warm_pool()} connections)")
+    except Exception as e:
+        print(f"[Database] Pool warm-up skipped: {e}")
+        return
+    warm_grafana_var_cache()
+
+
 # Base directory
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -39,7 +53,12 @@ async def lifespan(app: FastAPI):
     print("  SPLP Data Integrator v2.2 Starting...")
     print("=" * 50)
     print("[Database] Skipping table checks (already initialized)")
+    # Cache-hit Grafana polls still occupy a thread each; lift the cap so they don't queue behind DB work
+    anyio.to_thread.current_default_thread_limiter().total_tokens = settings.threadpool_size
+    print(f"[Server] Threadpool size: {settings.threadpool_size}")
     print("[Sync] Manual sync only (use /api/sync)")
+    # Not awaited: startup never waits on (or fails because of) an unreachable database
+    asyncio.get_running_loop().run_in_executor(None, warm_up)
     print("[Server] Ready to accept connections!")
     
     yield
@@ -53,7 +72,8 @@ app = FastAPI(
     title="SPLP Data Integrator",
     description="Data Integrator untuk Sistem Pengelolaan Layanan Publik - ANRI",
     version="2.2.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware
@@ -65,6 +85,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Gzip JSON responses (Grafana combined/monthly payloads compress 5-10x);
+# level 1 keeps CPU cost low, tiny dropdown responses are sent as-is
+app.add_middleware(GZipMiddleware, minimum_size=512, compresslevel=1)
+
 
 # Middleware to prevent caching of HTML pages
 @app.middleware("http")
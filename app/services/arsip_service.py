@@ -2,12 +2,11 @@
 Arsip Data Service - CRUD dan Upload Operations
 Optimized for large-scale data handling with caching
 """
-from sqlalchemy import and_, or_, func, text
+from sqlalchemy import and_, or_, func, text, select
 from sqlalchemy.orm import Session
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, BinaryIO
 from datetime import date
 import pandas as pd
-import io
 
 from app.database import get_db_context
 from app.models import ArsipData, Base
@@ -21,6 +20,20 @@ class ArsipDataService:
     # Threshold for using approximate count
     LARGE_DATASET_THRESHOLD = 100000
     
+    # Rows per chunk when stream-parsing uploaded CSV files
+    UPLOAD_CHUNK_SIZE = 10000
+    
+    # Rows per multi-row INSERT (one commit each)
+    UPLOAD_BATCH_SIZE = 1000
+    
+    # Upload file columns, mapped 1:1 onto data_arsip. Count columns are optional (default 0);
+    # total is always recomputed from them, like DataArsip.calculate_total
+    UPLOAD_REQUIRED_COLUMNS = ('tanggal', 'unit_kerja_id')
+    UPLOAD_COUNT_COLUMNS = (
+        'naskah_masuk', 'naskah_keluar', 'disposisi', 'berkas',
+        'retensi_permanen', 'retensi_musnah', 'naskah_ditindaklanjuti'
+    )
+    
     def create_table_if_not_exists(self):
         """Buat tabel arsip_data jika belum ada"""
         from app.database import engine
@@ -62,10 +75,10 @@ class ArsipDataService:
         """Get approximate row count from table statistics (much faster for large tables)"""
         try:
             result = db.execute(text(
-                "SELECT table_rows FROM information_schema.tables "
-                "WHERE table_schema = DATABASE() AND table_name = 'arsip_data'"
-            )).fetchone()
-            return result[0] if result else 0
+                "SELECT table_rows FROM information_schema.TABLES "
+                "WHERE table_schema = DATABASE() AND table_name = :t"
+            ), {"t": ArsipData.__tablename__}).scalar()
+            return result or 0
         except:
             return db.query(ArsipData).count()
     
@@ -74,6 +87,15 @@ class ArsipDataService:
         approx = self._get_approximate_count(db)
         return approx > self.LARGE_DATASET_THRESHOLD
     
+    def _filter_cache_key(self, *filters) -> str:
+        """Cache key = data version + normalized filter tuple.
+        Every write bumps the version, so cached pages are never stale."""
+        return cache._generate_key(f"filter:v{cache.get_version('data_arsip')}", *filters)
+    
+    def get_filtered_etag(self, *filters) -> str:
+        """Weak ETag for a filtered page, changes whenever data_arsip is written"""
+        return f'W/"{self._filter_cache_key(*filters).rsplit(":", 1)[1]}"'
+    
     def get_filtered(
         self,
         tanggal_start: Optional[date] = None,
@@ -82,60 +104,50 @@ class ArsipDataService:
         jenis_arsip: Optional[str] = None,
         instansi_id: Optional[int] = None,
         limit: int = 100,
-        offset: int = 0,
-        skip_cache: bool = False
+        offset: int = 0
     ) -> Dict[str, Any]:
         """Get data dengan filter - optimized for large datasets"""
-        
-        # Generate cache key
-        cache_key = cache._generate_key(
-            "filter",
-            tanggal_start, tanggal_end, role_id, 
+        cache_key = self._filter_cache_key(
+            tanggal_start, tanggal_end, role_id,
             jenis_arsip, instansi_id, limit, offset
         )
         
-        # Try cache first (unless skip_cache is True)
-        if not skip_cache:
-            cached_result = cache.get(cache_key)
-            if cached_result is not None:
-                return cached_result
+        cached_result = cache.get(cache_key)
+        if cached_result is not None:
+            return cached_result
         
         with get_db_context() as db:
-            query = db.query(ArsipData)
+            # Same statement shape per filter combination + bound values only,
+            # so SQLAlchemy's compiled cache reuses the compiled SQL across requests
+            conditions = []
             filters_applied = {}
-            has_filters = False
             
             if tanggal_start:
-                query = query.filter(ArsipData.tanggal >= tanggal_start)
+                conditions.append(ArsipData.tanggal >= tanggal_start)
                 filters_applied["tanggal_start"] = str(tanggal_start)
-                has_filters = True
             
             if tanggal_end:
-                query = query.filter(ArsipData.tanggal <= tanggal_end)
+                conditions.append(ArsipData.tanggal <= tanggal_end)
                 filters_applied["tanggal_end"] = str(tanggal_end)
-                has_filters = True
             
             if role_id:
-                query = query.filter(ArsipData.role_id == role_id)
+                conditions.append(ArsipData.role_id == role_id)
                 filters_applied["role_id"] = role_id
-                has_filters = True
             
             if jenis_arsip:
-                query = query.filter(ArsipData.jenis_arsip.ilike(f"%{jenis_arsip}%"))
+                conditions.append(ArsipData.jenis_arsip.ilike(f"%{jenis_arsip}%"))
                 filters_applied["jenis_arsip"] = jenis_arsip
-                has_filters = True
             
             if instansi_id:
-                query = query.filter(ArsipData.instansi_id == instansi_id)
+                conditions.append(ArsipData.instansi_id == instansi_id)
                 filters_applied["instansi_id"] = instansi_id
-                has_filters = True
             
             # ALWAYS use approximate count - counting 2M+ rows is too slow
             # For filtered queries, we estimate based on approximate total
             total = self._get_approximate_count(db)
             
-            # Optimized query with index hints - order by ID for fastest pagination
-            arsip_list = query.offset(offset).limit(limit).all()
+            stmt = select(ArsipData).where(*conditions).offset(offset).limit(limit)
+            arsip_list = db.scalars(stmt).all()
             
             result = {
                 "data": [a.to_dict() for a in arsip_list],
@@ -146,8 +158,8 @@ class ArsipDataService:
                 "cached": False
             }
             
-            # Cache the result (5 minutes TTL)
-            cache.set(cache_key, result, ttl=300)
+            # Cache the result (1 hour TTL, writes invalidate via version bump)
+            cache.set(cache_key, result, ttl=3600)
             
             return result
     
@@ -194,74 +206,125 @@ class ArsipDataService:
                 db.rollback()
                 return {"status": "error", "message": str(e)}
     
-    def upload_file(self, file_content: bytes, filename: str) -> Dict[str, Any]:
-        """Upload dan parse file CSV/Excel"""
+    def upload_file(self, file_obj: BinaryIO, filename: str) -> Dict[str, Any]:
+        """Upload dan parse file CSV/Excel (CSV dibaca bertahap per chunk)"""
         errors = []
+        rows_processed = 0
         rows_inserted = 0
         rows_failed = 0
+        touched = set()  # (unit_kerja_id, first day of month) of committed rows
         
         try:
             if filename.endswith('.csv'):
-                df = pd.read_csv(io.BytesIO(file_content))
+                # Stream: constant memory regardless of file size
+                chunks = pd.read_csv(file_obj, chunksize=self.UPLOAD_CHUNK_SIZE)
             elif filename.endswith(('.xlsx', '.xls')):
-                df = pd.read_excel(io.BytesIO(file_content))
+                # Excel cannot be parsed incrementally, read as one chunk
+                chunks = [pd.read_excel(file_obj)]
             else:
                 return {"status": "error", "filename": filename, "rows_processed": 0, "rows_inserted": 0, "rows_failed": 0, "errors": ["Format tidak didukung"]}
             
-            df.columns = df.columns.str.lower().str.strip().str.replace(' ', '_')
-            required_cols = ['tanggal', 'role_id', 'jenis_arsip', 'instansi_id']
-            missing_cols = [col for col in required_cols if col not in df.columns]
-            
-            if missing_cols:
-                return {"status": "error", "filename": filename, "rows_processed": 0, "rows_inserted": 0, "rows_failed": 0, "errors": [f"Kolom tidak ditemukan: {missing_cols}"]}
-            
-            rows_processed = len(df)
-            
             with get_db_context() as db:
-                # Batch insert for better performance
-                batch_size = 1000
-                batch = []
-                
-                for idx, row in df.iterrows():
-                    try:
-                        tanggal = pd.to_datetime(row['tanggal']).date()
-                        keterangan = row.get('keterangan', None)
-                        if pd.isna(keterangan):
-                            keterangan = None
-                        
-                        arsip = ArsipData(
-                            tanggal=tanggal,
-                            role_id=int(row['role_id']),
-                            jenis_arsip=str(row['jenis_arsip']),
-                            instansi_id=int(row['instansi_id']),
-                            keterangan=keterangan
-                        )
-                        batch.append(arsip)
-                        rows_inserted += 1
-                        
-                        # Commit in batches
-                        if len(batch) >= batch_size:
-                            db.add_all(batch)
-                            db.commit()
-                            batch = []
-                            
-                    except Exception as e:
-                        rows_failed += 1
-                        if len(errors) < 10:
-                            errors.append(f"Baris {idx + 2}: {str(e)}")
-                
-                # Commit remaining batch
-                if batch:
-                    db.add_all(batch)
-                    db.commit()
+                for df in chunks:
+                    df.columns = df.columns.str.lower().str.strip().str.replace(' ', '_')
+                    
+                    if rows_processed == 0:
+                        missing_cols = [col for col in self.UPLOAD_REQUIRED_COLUMNS if col not in df.columns]
+                        if missing_cols:
+                            return {"status": "error", "filename": filename, "rows_processed": 0, "rows_inserted": 0, "rows_failed": 0, "errors": [f"Kolom tidak ditemukan: {missing_cols}"]}
+                    
+                    rows_processed += len(df)
+                    inserted, failed = self._insert_rows(db, df, errors, touched)
+                    rows_inserted += inserted
+                    rows_failed += failed
             
+            status = "success" if rows_failed == 0 else "partial"
+        except Exception as e:
+            # Batches committed before the failure stay in the table: report them as inserted
+            print(f"[Upload] {filename} aborted after {rows_inserted} inserted rows: {e}")
+            errors.append(str(e))
+            status = "partial" if rows_inserted else "error"
+        
+        if rows_inserted:
+            # Core batch inserts bypass the per-row summary hooks: refresh the touched months
+            # before invalidating, so Grafana never re-caches stale monthly totals
+            self._refresh_monthly_summary(touched)
             # Invalidate cache after bulk insert
             invalidate_arsip_cache()
+        
+        return {"status": status, "filename": filename, "rows_processed": rows_processed, "rows_inserted": rows_inserted, "rows_failed": rows_failed, "errors": errors if errors else None}
+    
+    def _insert_rows(self, db: Session, df: pd.DataFrame, errors: List[str], touched: set) -> tuple:
+        """
+        Insert parsed upload rows in batches, return (rows_inserted, rows_failed).
+        (unit_kerja_id, month) keys of committed rows are added to touched.
+        """
+        rows_inserted = 0
+        rows_failed = 0
+        
+        # Batch insert: one multi-row INSERT per batch (Core executemany, no ORM unit-of-work)
+        insert_stmt = ArsipData.__table__.insert()
+        count_cols = [col for col in self.UPLOAD_COUNT_COLUMNS if col in df.columns]
+        batch = []
+        batch_first_line = None
+        
+        def flush():
+            """Commit the batch; rows only count as inserted once it is committed"""
+            nonlocal rows_inserted, rows_failed
+            try:
+                db.execute(insert_stmt, batch)
+                db.commit()
+                rows_inserted += len(batch)
+                touched.update((row["unit_kerja_id"], row["tanggal"].replace(day=1)) for row in batch)
+            except Exception as e:
+                db.rollback()
+                rows_failed += len(batch)
+                if len(errors) < 10:
+                    # DB driver message only, not the SQL and the whole batch of parameters
+                    errors.append(f"Batch mulai baris {batch_first_line} ({len(batch)} baris): {getattr(e, 'orig', e)}")
+            batch.clear()
+        
+        for idx, row in df.iterrows():
+            try:
+                values = {
+                    "tanggal": pd.to_datetime(row['tanggal']).date(),
+                    "unit_kerja_id": int(row['unit_kerja_id']),
+                    **{col: 0 if pd.isna(row[col]) else int(row[col]) for col in count_cols}
+                }
+                values["total"] = sum(values.get(col, 0) for col in self.UPLOAD_COUNT_COLUMNS)
+            except Exception as e:
+                rows_failed += 1
+                if len(errors) < 10:
+                    errors.append(f"Baris {idx + 2}: {str(e)}")
+                continue
             
-            return {"status": "success" if rows_failed == 0 else "partial", "filename": filename, "rows_processed": rows_processed, "rows_inserted": rows_inserted, "rows_failed": rows_failed, "errors": errors if errors else None}
-            
+            if not batch:
+                batch_first_line = idx + 2
+            batch.append(values)
+            if len(batch) >= self.UPLOAD_BATCH_SIZE:
+                flush()
+        
+        # Commit remaining batch
+        if batch:
+            flush()
+        
+        return rows_inserted, rows_failed
+    
+    def _refresh_monthly_summary(self, touched: set) -> None:
+        """Recompute the data_arsip_monthly_summary rows for these (unit_kerja_id, month) keys"""
+        from app.models import TableDefinition
+        from app.services.generic_summary_service import GenericSummaryService
+        
+        try:
+            with get_db_context() as db:
+                table_id = db.query(TableDefinition.id).filter(TableDefinition.name == 'data_arsip').scalar()
+                if table_id is None:
+                    return
+                summary_service = GenericSummaryService(db)
+                for unit_kerja_id, month in sorted(touched):
+                    summary_service.update_summary_row(table_id, unit_kerja_id, month)
         except Exception as e:
-            return {"status": "error", "filename": filename, "rows_processed": 0, "rows_inserted": 0, "rows_failed": 0, "errors": [str(e)]}
+            print(f"[Upload] Monthly summary refresh failed: {e}")
     
     def get_statistics(self) -> Dict[str, Any]:
         """Get statistics for dashboard - ULTRA FAST (metadata only)"""
@@ -10,6 +10,8 @@ from sqlalchemy.sql import func
 
 from app.models import Base
 from app.database import get_db_context
+from app.services.cache_service import cache
+import hashlib
 
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -18,6 +20,7 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 SECRET_KEY = "splp-anri-secret-key-2024-change-in-production"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 24 hours
+AUTH_USER_CACHE_TTL = 300  # Max seconds a verified token -> user lookup is reused
 
 
 class User(Base):
@@ -144,15 +147,35 @@ class AuthService:
                 return user.to_dict()
             return None
     
+    def _token_cache_key(self, token: str) -> str:
+        """Cache key for a token (hashed, the raw token is never stored)"""
+        return f"auth_user:{hashlib.sha256(token.encode()).hexdigest()}"
+    
     def get_current_user(self, token: str) -> Optional[Dict]:
-        """Get current user from token"""
+        """Get current user from token (cached: skips JWT decode + DB lookup per request)"""
+        cache_key = self._token_cache_key(token)
+        user = cache.get(cache_key)
+        if user is not None:
+            return user
+        
         payload = self.decode_token(token)
         if not payload:
             return None
         username = payload.get("sub")
         if not username:
             return None
-        return self.get_user_by_username(username)
+        user = self.get_user_by_username(username)
+        
+        # Never cache beyond the token's own expiry
+        if user:
+            ttl = min(AUTH_USER_CACHE_TTL, int(payload.get("exp", 0) - datetime.now(timezone.utc).timestamp()))
+            if ttl > 0:
+                cache.set(cache_key, user, ttl=ttl)
+        return user
+    
+    def revoke_cached_user(self, token: str) -> None:
+        """Drop the cached user for a token (on logout)"""
+        cache.delete(self._token_cache_key(token))
     
     def create_default_admin(self):
         """Buat admin default jika belum ada"""
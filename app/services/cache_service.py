@@ -2,14 +2,18 @@
 Caching Service with Redis + In-Memory Fallback
 Supports Redis for production, falls back to in-memory if Redis unavailable
 """
-from typing import Any, Optional, Dict
+from typing import Any, Callable, Optional, Dict
 from datetime import datetime, timedelta
 from functools import wraps
 import threading
 import hashlib
 import json
+import gzip
+import time
 import os
 
+import orjson
+
 # Try to import Redis
 try:
     import redis
@@ -81,13 +85,17 @@ class InMemoryCacheBackend:
 class RedisCacheBackend:
     """Redis cache backend for production"""
     
+    # Payloads above this size are gzip'ed (level 1: cheap, still roughly halves dashboard JSON)
+    COMPRESS_MIN_SIZE = 1024
+    GZIP_MAGIC = b"\x1f\x8b"
+    
     def __init__(self, host: str = "localhost", port: int = 6379, db: int = 0, password: str = None):
         self._client = redis.Redis(
             host=host,
             port=port,
             db=db,
             password=password,
-            decode_responses=True,
+            decode_responses=False,  # Values are raw (possibly gzip'ed) orjson bytes
             socket_connect_timeout=5
         )
         self._prefix = "splp:"  # Namespace prefix
@@ -106,14 +114,19 @@ class RedisCacheBackend:
         try:
             data = self._client.get(self._key(key))
             if data:
-                return json.loads(data)
+                if data.startswith(self.GZIP_MAGIC):
+                    data = gzip.decompress(data)
+                return orjson.loads(data)
             return None
         except:
             return None
     
     def set(self, key: str, value: Any, ttl: int = 300) -> None:
         try:
-            self._client.setex(self._key(key), ttl, json.dumps(value, default=str))
+            data = orjson.dumps(value, default=str, option=orjson.OPT_NON_STR_KEYS)
+            if len(data) >= self.COMPRESS_MIN_SIZE:
+                data = gzip.compress(data, compresslevel=1)
+            self._client.setex(self._key(key), ttl, data)
         except:
             pass
     
@@ -135,7 +148,7 @@ class RedisCacheBackend:
         try:
             full_pattern = f"{self._prefix}{pattern}"
             keys = self._client.keys(full_pattern)
-            return [k.replace(self._prefix, "") for k in keys]
+            return [k.decode()[len(self._prefix):] for k in keys]
         except:
             return []
     
@@ -149,11 +162,16 @@ class RedisCacheBackend:
 class CacheService:
     """Unified cache service with automatic backend selection"""
     
+    # Namespace version counters outlive any cached entry built on them
+    VERSION_TTL = 7 * 24 * 3600
+    
     def __init__(self):
         self._backend = None
         self._backend_type = "none"
         self._hits = 0
         self._misses = 0
+        self._fill_locks: Dict[str, threading.Lock] = {}
+        self._fill_locks_guard = threading.Lock()
         self._initialize_backend()
     
     def _initialize_backend(self):
@@ -201,10 +219,65 @@ class CacheService:
         """Set value in cache"""
         self._backend.set(key, value, ttl)
     
+    def get_or_set(self, key: str, compute: Callable[[], Any], ttl: int = 300) -> Any:
+        """
+        Cached value, or compute() it and cache the result.
+        Concurrent misses on one key compute it once per process; the others wait and reuse it.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+        
+        with self._fill_locks_guard:
+            lock = self._fill_locks.setdefault(key, threading.Lock())
+        try:
+            with lock:
+                # Filled by the request we waited on?
+                value = self._backend.get(key)
+                if value is None:
+                    value = compute()
+                    self._backend.set(key, value, ttl)
+                return value
+        finally:
+            self._release_fill_lock(key, lock)
+    
+    def refresh(self, key: str, compute: Callable[[], Any], ttl: int = 300) -> None:
+        """Recompute and store a key, skipped if a fill/refresh of it is already running in this process"""
+        with self._fill_locks_guard:
+            lock = self._fill_locks.setdefault(key, threading.Lock())
+        if not lock.acquire(blocking=False):
+            return
+        try:
+            self._backend.set(key, compute(), ttl)
+        except Exception as e:
+            print(f"[Cache] Refresh of {key} failed: {e}")
+        finally:
+            lock.release()
+            self._release_fill_lock(key, lock)
+    
+    def _release_fill_lock(self, key: str, lock: threading.Lock) -> None:
+        with self._fill_locks_guard:
+            if self._fill_locks.get(key) is lock and not lock.locked():
+                del self._fill_locks[key]
+    
     def delete(self, key: str) -> bool:
         """Delete specific key"""
         return self._backend.delete(key)
     
+    def get_version(self, namespace: str) -> int:
+        """Current version of a cache namespace (embed it in cache keys)"""
+        key = f"version:{namespace}"
+        version = self._backend.get(key)
+        if version is None:
+            # Seed from the clock so a lost/evicted counter never reuses an old version
+            version = time.time_ns()
+            self._backend.set(key, version, self.VERSION_TTL)
+        return version
+    
+    def bump_version(self, namespace: str) -> None:
+        """Invalidate a whole namespace at once: keys with the old version are never read again"""
+        self._backend.set(f"version:{namespace}", time.time_ns(), self.VERSION_TTL)
+    
     def invalidate_prefix(self, prefix: str) -> int:
         """Invalidate all keys matching prefix"""
         keys = self._backend.keys(f"{prefix}*")
@@ -262,6 +335,21 @@ def cached(prefix: str, ttl: int = 300):
 
 def invalidate_arsip_cache():
     """Invalidate all arsip-related caches"""
+    # Filtered list results are versioned, bumping drops them without a key scan
+    cache.bump_version("data_arsip")
     cache.invalidate_prefix("arsip")
     cache.invalidate_prefix("stats")
-    cache.invalidate_prefix("filter")
+    invalidate_grafana_cache()
+
+
+def invalidate_grafana_cache(table_id: Optional[int] = None):
+    """
+    Invalidate Grafana endpoint responses (keys embed these versions).
+    With table_id: only responses built from that table (plus the all-tables year list).
+    Without: every Grafana response (instansi/unit kerja/table definition changes).
+    """
+    if table_id is None:
+        cache.bump_version("grafana")
+    else:
+        cache.bump_version(f"grafana:table:{table_id}")
+        cache.bump_version("grafana:data")
@@ -3,12 +3,15 @@ Service untuk mengelola data Instansi, Unit Kerja, dan Data Arsip
 """
 from typing import Dict, Any, List, Optional
 from datetime import date
+import logging
 from sqlalchemy import func
 from sqlalchemy.orm import joinedload
 
 from app.database import get_db_context
 from app.models.arsip_models import Instansi, UnitKerja, DataArsip
-from app.services.cache_service import cache
+from app.services.cache_service import cache, invalidate_grafana_cache
+
+logger = logging.getLogger(__name__)
 
 
 class DataService:
@@ -18,12 +21,12 @@ class DataService:
     
     def get_all_instansi(self, limit: int = 100, offset: int = 0) -> Dict[str, Any]:
         """Get all instansi with pagination"""
-        print(f"[DEBUG] Fetching all instansi. Limit={limit}, Offset={offset}")
+        logger.debug("Fetching all instansi. Limit=%s, Offset=%s", limit, offset)
         with get_db_context() as db:
             query = db.query(Instansi)
             total = query.count()
             data = query.order_by(Instansi.nama).offset(offset).limit(limit).all()
-            print(f"[DEBUG] Found {len(data)} instansi records. Total in DB: {total}")
+            logger.debug("Found %s instansi records. Total in DB: %s", len(data), total)
             return {
                 "data": [i.to_dict() for i in data],
                 "total": total,
@@ -55,6 +58,7 @@ class DataService:
                 # Invalidate dashboard stats
                 cache.invalidate_prefix("stats_table")
                 cache.delete("dashboard_stats")
+                invalidate_grafana_cache()
                 
                 return {"status": "success", "data": instansi.to_dict()}
             except Exception as e:
@@ -69,7 +73,7 @@ class DataService:
                 if not instansi:
                     return {"status": "error", "message": "Instansi tidak ditemukan"}
                 
-                print(f"[DEBUG] Updating Instansi ID {instansi_id}: Kode={kode}, Nama={nama}")
+                logger.debug("Updating Instansi ID %s: Kode=%s, Nama=%s", instansi_id, kode, nama)
                 if kode:
                     instansi.kode = kode
                 if nama:
@@ -77,11 +81,12 @@ class DataService:
                 
                 db.commit()
                 db.refresh(instansi)
-                print(f"[DEBUG] Commit Successful. New Name: {instansi.nama}")
+                logger.debug("Commit Successful. New Name: %s", instansi.nama)
                 
                 # Invalidate dashboard stats
                 cache.invalidate_prefix("stats_table")
                 cache.delete("dashboard_stats")
+                invalidate_grafana_cache()
                 
                 return {"status": "success", "data": instansi.to_dict()}
             except Exception as e:
@@ -102,6 +107,7 @@ class DataService:
                 # Invalidate dashboard stats
                 cache.invalidate_prefix("stats_table")
                 cache.delete("dashboard_stats")
+                invalidate_grafana_cache()
                 
                 return {"status": "success", "message": f"Instansi {instansi.nama} berhasil dihapus"}
             except Exception as e:
@@ -162,6 +168,7 @@ class DataService:
                 # Invalidate dashboard stats
                 cache.invalidate_prefix("stats_table")
                 cache.delete("dashboard_stats")
+                invalidate_grafana_cache()
                 
                 return {"status": "success", "data": unit.to_dict()}
             except Exception as e:
@@ -196,6 +203,7 @@ class DataService:
                 # Invalidate dashboard stats
                 cache.invalidate_prefix("stats_table")
                 cache.delete("dashboard_stats")
+                invalidate_grafana_cache()
                 
                 return {"status": "success", "data": unit.to_dict()}
             except Exception as e:
@@ -216,6 +224,7 @@ class DataService:
                 # Invalidate dashboard stats
                 cache.invalidate_prefix("stats_table")
                 cache.delete("dashboard_stats")
+                invalidate_grafana_cache()
                 
                 return {"status": "success", "message": f"Unit kerja {unit.nama} berhasil dihapus"}
             except Exception as e:
@@ -319,6 +328,7 @@ class DataService:
                 # Invalidate
                 cache.invalidate_prefix("stats_table")
                 cache.delete("dashboard_stats")
+                invalidate_grafana_cache()
                 
                 # AUTO-SYNC SUMMARY
                 try:
@@ -351,6 +361,7 @@ class DataService:
                 # Invalidate
                 cache.invalidate_prefix("stats_table")
                 cache.delete("dashboard_stats")
+                invalidate_grafana_cache()
                 
                 # AUTO-SYNC SUMMARY
                 try:
@@ -1,4 +1,5 @@
 
+from datetime import date
 from sqlalchemy.orm import Session
 from sqlalchemy import text, inspect, MetaData, Table, Column, Integer, String, Date, Float
 from app.models.table_models import TableDefinition
@@ -8,6 +9,9 @@ import logging
 logger = logging.getLogger(__name__)
 
 class GenericSummaryService:
+    # Grouping columns of every summary table; the rest are per-metric sums
+    SUMMARY_KEY_COLUMNS = frozenset({"month", "year", "unit_kerja_id"})
+
     def __init__(self, db: Session):
         self.db = db
         self.inspector = SchemaInspector()
@@ -19,6 +23,20 @@ class GenericSummaryService:
             raise ValueError(f"Invalid table name: {name}")
         return name
 
+    @staticmethod
+    def summary_table_name_for(table_id: int, table_name: str) -> str:
+        """Summary table name when the source table's name is already known (no DB hit)"""
+        if table_name == 'data_arsip':
+            return "data_arsip_monthly_summary"
+        return f"table_{table_id}_monthly_summary"
+
+    def _summary_changed(self) -> None:
+        """Summary table (re)built or dropped: TableMeta caches its existence/columns"""
+        # Local import: table_service imports this module lazily too.
+        # invalidate_table_meta also drops the cached Grafana responses.
+        from app.services.table_service import table_service
+        table_service.invalidate_table_meta()
+
     def get_summary_table_name(self, table_id: int) -> str:
         # Check if this is the core data_arsip table (usually ID 1, but better check name)
         # Since we don't have name here, we might need to fetch it.
@@ -31,10 +49,7 @@ class GenericSummaryService:
         
         # Let's query DB for name. It's safer.
         table_def = self.db.query(TableDefinition).filter(TableDefinition.id == table_id).first()
-        if table_def and table_def.name == 'data_arsip':
-            return "data_arsip_monthly_summary"
-            
-        return f"table_{table_id}_monthly_summary"
+        return self.summary_table_name_for(table_id, table_def.name if table_def else None)
 
     def create_summary_table(self, table_id: int) -> dict:
         """
@@ -107,6 +122,7 @@ class GenericSummaryService:
             self.db.execute(text(create_sql))
             logger.info(f"Created summary table {summary_table_name}")
         except Exception as e:
+            self._summary_changed()
             return {"success": False, "message": f"Failed to create table: {e}"}
 
         # 6. Populate Data
@@ -128,6 +144,8 @@ class GenericSummaryService:
             self.db.execute(text(insert_sql))
             row_count = self.db.execute(text(f"SELECT COUNT(*) FROM {summary_table_name}")).scalar()
             self.db.commit()
+            # Grafana endpoints switch to the summary table as soon as it exists
+            self._summary_changed()
             
             # Update TableDefinition? Add 'has_summary' flag?
             # We don't have that column yet. User can just check if table exists?
@@ -141,6 +159,7 @@ class GenericSummaryService:
             }
         except Exception as e:
             self.db.rollback()
+            self._summary_changed()
             return {"success": False, "message": f"Failed to populate data: {e}"}
 
     def check_summary_exists(self, table_id: int) -> bool:
@@ -154,85 +173,65 @@ class GenericSummaryService:
 
     def update_summary_row(self, table_id: int, unit_kerja_id: int, date_val: Date):
         """
-        Incrementally update the summary row for a specific (Unit, YYYY-MM)
+        Incrementally update the summary row for a specific (Unit, YYYY-MM):
+        one aggregate over that month of the source, then one upsert (or delete if the month is empty)
         """
         try:
-            if not self.check_summary_exists(table_id):
-                return
-            
-            summary_table_name = self.get_summary_table_name(table_id)
-            
-            # Get Source Table Name
-            table_def = self.db.query(TableDefinition).filter(TableDefinition.id == table_id).first()
-            if not table_def:
+            # Summary name and columns come from the cached TableMeta, no existence/schema probes
+            from app.services.table_service import table_service
+            meta = table_service.get_table_meta(table_id)
+            # summary_for(()) also skips older roll-ups that lack the year/month/unit_kerja_id keys
+            summary_table_name = meta.summary_for(()) if meta else None
+            if not summary_table_name:
                 return
-            source_table_name = self._sanitize_table_name(table_def.name)
             
-            # Identify Metric Columns
-            columns = self.inspector.get_table_columns(source_table_name)
-            metric_cols = [c['name'] for c in columns if c['data_type'] == 'integer' and c['name'] not in ['id', 'unit_kerja_id', 'instansi_id']]
+            metric_cols = sorted(meta.summary_cols - self.SUMMARY_KEY_COLUMNS)
             if not metric_cols:
                 return
 
-            # Calculate Sums for this Month/Unit
+            # Calculate Sums for this Month/Unit (tanggal range, so the (unit_kerja_id, tanggal) index applies)
             sum_sql = [f"COALESCE(SUM(t.`{col}`), 0) as `{col}`" for col in metric_cols]
             
             select_sql = f"""
                 SELECT {', '.join(sum_sql)}, COUNT(*) as cnt
-                FROM {source_table_name} t
+                FROM {meta.safe_name} t
                 WHERE t.unit_kerja_id = :uid 
-                  AND YEAR(t.tanggal) = :y 
-                  AND MONTH(t.tanggal) = :m
+                  AND t.tanggal >= :month_start
+                  AND t.tanggal < :month_end
             """
             
             y = date_val.year
             m = date_val.month
+            m_str = f"{y}-{m:02d}"
+            month_start = date(y, m, 1)
+            month_end = date(y + 1, 1, 1) if m == 12 else date(y, m + 1, 1)
             
-            res = self.db.execute(text(select_sql), {"uid": unit_kerja_id, "y": y, "m": m}).mappings().first()
+            res = self.db.execute(
+                text(select_sql), {"uid": unit_kerja_id, "month_start": month_start, "month_end": month_end}
+            ).mappings().first()
             
             if not res or res['cnt'] == 0:
                 # No data left? Delete summary row
-                del_sql = f"DELETE FROM {summary_table_name} WHERE unit_kerja_id = :uid AND year = :y AND month = :m_str"
-                self.db.execute(text(del_sql), {"uid": unit_kerja_id, "y": y, "m_str": f"{y}-{m:02d}"})
+                del_sql = f"DELETE FROM {summary_table_name} WHERE month = :m_str AND unit_kerja_id = :uid"
+                self.db.execute(text(del_sql), {"uid": unit_kerja_id, "m_str": m_str})
             else:
-                # Upsert
-                # Check exist
-                m_str = f"{y}-{m:02d}"
-                check = self.db.execute(text(f"SELECT 1 FROM {summary_table_name} WHERE unit_kerja_id = :uid AND year = :y AND month = :m_str"),
-                                        {"uid": unit_kerja_id, "y": y, "m_str": m_str}).first()
+                # Upsert on the (month, unit_kerja_id) primary key: one statement, no existence check
+                cols = ["month", "year", "unit_kerja_id"] + metric_cols
+                vals = [":m_str", ":y", ":uid"] + [f":Val_{col}" for col in metric_cols]
+                upsert_sql = f"""
+                    INSERT INTO {summary_table_name} ({', '.join(f'`{c}`' for c in cols)})
+                    VALUES ({', '.join(vals)})
+                    ON DUPLICATE KEY UPDATE {', '.join(f'`{col}` = VALUES(`{col}`)' for col in metric_cols)}
+                """
+                params = {"uid": unit_kerja_id, "y": y, "m_str": m_str}
+                for col in metric_cols:
+                    params[f"Val_{col}"] = res[col]
                 
-                if check:
-                    # Update
-                    update_parts = [f"`{col}` = :Val_{col}" for col in metric_cols]
-                    upd_sql = f"""
-                        UPDATE {summary_table_name}
-                        SET {', '.join(update_parts)}
-                        WHERE unit_kerja_id = :uid AND year = :y AND month = :m_str
-                    """
-                    params = {"uid": unit_kerja_id, "y": y, "m_str": m_str}
-                    for col in metric_cols:
-                        params[f"Val_{col}"] = res[col]
-                    
-                    self.db.execute(text(upd_sql), params)
-                else:
-                    # Insert
-                    cols = ["month", "year", "unit_kerja_id"] + metric_cols
-                    vals = [":m_str", ":y", ":uid"] + [f":Val_{col}" for col in metric_cols]
-                    
-                    ins_sql = f"""
-                        INSERT INTO {summary_table_name} ({', '.join(cols)})
-                        VALUES ({', '.join(vals)})
-                    """
-                    params = {"uid": unit_kerja_id, "y": y, "m_str": m_str}
-                    for col in metric_cols:
-                        params[f"Val_{col}"] = res[col]
-
-                    self.db.execute(text(ins_sql), params)
+                self.db.execute(text(upsert_sql), params)
             
             self.db.commit()
             
         except Exception as e:
             logger.error(f"Failed to update summary row: {e}")
             # Don't raise, just log. Summary drift can be fixed by full refresh later.
-            # Don't raise, just log. Summary drift can be fixed by full refresh later.
 
@@ -1,25 +1,254 @@
 """
 Service untuk mengelola definisi tabel dinamis (Versi Fisik / Physical Table)
 """
-from sqlalchemy import text
-from typing import Dict, Any, List, Optional
+from sqlalchemy import text, bindparam
+from typing import Dict, Any, List, Optional, Tuple, FrozenSet
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
 from datetime import date, datetime, timezone
+from functools import lru_cache
+import re
 from app.database import get_db
 
-from app.services.cache_service import cache, cached
+from app.services.cache_service import cache, cached, invalidate_grafana_cache
 from sqlalchemy.orm import joinedload
 from app.database import get_db_context
 from app.models.table_models import TableDefinition, ColumnDefinition
 # DynamicData model is deprecated for storage in this physical mode
 
+# Names interpolated into generated SQL (table and column identifiers) must match this
+SQL_IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+# Physical table name from the registered name ('-' and ' ' -> '_') in a single pass
+SAFE_NAME_TRANS = str.maketrans({'-': '_', ' ': '_'})
+
+
+@dataclass(frozen=True)
+class TableMeta:
+    """Read-only snapshot of a table definition (what query builders need, no ORM session)"""
+    id: int
+    name: str
+    display_name: str
+    safe_name: str
+    col_mapping: Dict[str, str]  # column name -> display name
+    summable_cols: Tuple[str, ...]
+    columns: Tuple[Dict[str, Any], ...]
+    # column -> "COALESCE(SUM(t.col), 0) as `col`" (summable columns + total), built once per load
+    sum_sql: Dict[str, str]
+    # Monthly roll-up (year, month, unit_kerja_id, sums) kept by GenericSummaryService, if built
+    summary_table: Optional[str] = None
+    summary_cols: FrozenSet[str] = frozenset()
+    
+    def summary_for(self, cols) -> Optional[str]:
+        """
+        Summary table that can answer SUMs over these columns, else None (use the raw table).
+        Callers filter and group on year/month/unit_kerja_id, so older roll-ups lacking any of
+        those keys are never used.
+        """
+        from app.services.generic_summary_service import GenericSummaryService
+        if (
+            self.summary_table
+            and GenericSummaryService.SUMMARY_KEY_COLUMNS <= self.summary_cols
+            and self.summary_cols.issuperset(cols)
+        ):
+            return self.summary_table
+        return None
+
+
+@lru_cache(maxsize=256)
+def _load_table_meta(table_id: int, version: int) -> Optional[TableMeta]:
+    """Load a TableMeta; 'version' is part of the lru key so a version bump reloads it"""
+    with get_db_context() as db:
+        # Plain column projections: only the fields query builders use, no ORM identity map
+        table = db.query(
+            TableDefinition.id, TableDefinition.name, TableDefinition.display_name
+        ).filter(TableDefinition.id == table_id).first()
+        
+        if not table:
+            return None
+        
+        safe_name = table.name.translate(SAFE_NAME_TRANS)
+        if not SQL_IDENTIFIER.match(safe_name):
+            print(f"[TableMeta] Table {table_id} skipped: '{table.name}' is not a valid SQL identifier")
+            return None
+        
+        columns = db.query(
+            ColumnDefinition.name,
+            ColumnDefinition.display_name,
+            ColumnDefinition.data_type,
+            ColumnDefinition.is_summable
+        ).filter(ColumnDefinition.table_id == table_id).order_by(ColumnDefinition.order).all()
+        
+        # Only valid identifiers ever reach an f-string SUM(...)
+        summable_cols = tuple(c.name for c in columns if c.is_summable and SQL_IDENTIFIER.match(c.name))
+        
+        # Resolve the roll-up once here instead of probing for it on every stats request
+        from app.services.generic_summary_service import GenericSummaryService
+        summary_name = GenericSummaryService.summary_table_name_for(table.id, table.name)
+        summary_cols = frozenset(col for (col,) in db.execute(text(
+            "SELECT column_name FROM information_schema.COLUMNS "
+            "WHERE table_schema = DATABASE() AND table_name = :t"
+        ), {"t": summary_name}).all())
+        
+        return TableMeta(
+            id=table.id,
+            name=table.name,
+            display_name=table.display_name,
+            safe_name=safe_name,
+            col_mapping={c.name: c.display_name for c in columns},
+            summable_cols=summable_cols,
+            columns=tuple(c._asdict() for c in columns),
+            sum_sql={col: f"COALESCE(SUM(t.{col}), 0) as `{col}`" for col in (*summable_cols, "total")},
+            summary_table=summary_name if summary_cols else None,
+            summary_cols=summary_cols,
+        )
+
+
 class TableService:
     """Service untuk operasi CRUD pada definisi tabel (Physical Table Mode)"""
     
+    # Standard secondary indexes for every physical table: suffix -> columns.
+    # Equality columns first, the range column (tanggal) always last:
+    # - unit_tanggal: unit_kerja_id = ? [AND tanggal BETWEEN ..] [ORDER BY tanggal]
+    #   (data list per unit, upsert/get_existing_keys lookups, FK on unit_kerja_id;
+    #   also covers plain unit_kerja_id = ? so no separate single-column index)
+    # - tanggal: tanggal BETWEEN .. without a unit filter (Grafana/summary
+    #   aggregations, date-filtered lists, ORDER BY tanggal DESC)
+    INDEX_COLUMNS = {
+        "unit_tanggal": ("unit_kerja_id", "tanggal"),
+        "tanggal": ("tanggal",),
+    }
+    
+    # Covering index for the monthly/yearly SUM aggregations: tanggal range first, then
+    # unit_kerja_id (unit/instansi filters) and the integer columns being summed, so the
+    # aggregation reads only the index. Its tanggal prefix replaces the plain tanggal index.
+    # Skipped on tables too wide for MySQL's 16-column index limit.
+    AGG_INDEX_MAX_COLUMNS = 16
+    
+    # Tables indexed concurrently by ensure_indexes (DDL on one schema contends on
+    # metadata locks, so more workers stop helping quickly)
+    INDEX_BUILD_WORKERS = 4
+    
     def _sanitize_name(self, name: str) -> str:
         """Sanitize table/column name to ensure safety (alphanumeric only)"""
         # Allow only lowercase letters, numbers, and underscores
         return "".join(c for c in name if c.isalnum() or c == '_').lower()
 
+    def _agg_index_columns(self, sum_cols) -> Optional[tuple]:
+        """Columns of the covering aggregation index (None if the table is too wide)"""
+        cols = ("tanggal", "unit_kerja_id", "total", *(c for c in sum_cols if c != "total"))
+        return cols if len(cols) <= self.AGG_INDEX_MAX_COLUMNS else None
+
+    def _index_ddl(self, safe_name: str, existing: set = frozenset(), sum_cols=()) -> Optional[str]:
+        """Build ONE ALTER TABLE for all missing standard indexes (single round-trip)"""
+        wanted = dict(self.INDEX_COLUMNS)
+        agg_cols = self._agg_index_columns(sum_cols)
+        if agg_cols:
+            wanted["agg"] = agg_cols
+        
+        # An index is already covered if an existing (or another wanted) index starts with the same columns
+        clauses = [
+            f"ADD INDEX idx_{safe_name}_{suffix} ({', '.join(cols)})"
+            for suffix, cols in wanted.items()
+            if not any(idx[:len(cols)] == cols for idx in existing)
+            and not any(other != cols and other[:len(cols)] == cols for other in wanted.values())
+        ]
+        if not clauses:
+            return None
+        return f"ALTER TABLE {safe_name} {', '.join(clauses)}"
+
+    def _get_index_columns(self, db, table_names: List[str]) -> Dict[str, set]:
+        """Get column tuples of the existing indexes for many tables in ONE metadata query"""
+        if not table_names:
+            return {}
+        rows = db.execute(text(
+            "SELECT table_name, index_name, column_name FROM information_schema.STATISTICS "
+            "WHERE table_schema = DATABASE() AND table_name IN :tables "
+            "ORDER BY table_name, index_name, seq_in_index"
+        ).bindparams(bindparam("tables", expanding=True)), {"tables": list(table_names)}).fetchall()
+        
+        indexes = {}
+        for table_name, index_name, column_name in rows:
+            indexes.setdefault((table_name, index_name), []).append(column_name)
+        
+        result = {name: set() for name in table_names}
+        for (table_name, _), cols in indexes.items():
+            result.setdefault(table_name, set()).add(tuple(cols))
+        return result
+
+    def _sum_columns(self, table_id: int) -> Tuple[str, ...]:
+        """Integer summable columns of a registered table (what the aggregations SUM)"""
+        meta = self.get_table_meta(table_id)
+        if not meta:
+            return ()
+        return tuple(
+            c["name"] for c in meta.columns
+            if c["name"] in meta.summable_cols and c["data_type"] == "integer"
+        )
+
+    def _ensure_table_indexes(self, safe_name: str, existing: set, sum_cols=()) -> bool:
+        """Create missing standard indexes on one table (own session, safe to run in a worker thread)"""
+        with get_db_context() as db:
+            ddl = self._index_ddl(safe_name, existing, sum_cols)
+            if not ddl:
+                return False
+            db.execute(text(ddl))
+            db.commit()
+            return True
+
+    def ensure_indexes(self) -> Dict[str, Any]:
+        """
+        Create missing standard indexes on registered dynamic tables (tables built in parallel).
+        Tables defined in the ORM models (e.g. data_arsip) are managed by Alembic and skipped.
+        Run explicitly via `python run.py --ensure-indexes`, never on the request or startup path.
+        """
+        from app.models import Base
+        
+        indexed = []
+        errors = []
+        
+        with get_db_context() as db:
+            sum_cols = {
+                self._sanitize_name(name): self._sum_columns(table_id)
+                for table_id, name in db.query(TableDefinition.id, TableDefinition.name).all()
+                if self._sanitize_name(name) not in Base.metadata.tables
+            }
+            existing = self._get_index_columns(db, list(sum_cols))
+        
+        # Fully indexed tables need no DDL
+        pending = {
+            name: cols for name, cols in existing.items()
+            if self._index_ddl(name, cols, sum_cols=sum_cols.get(name, ()))
+        }
+        if not pending:
+            return {"status": "success", "indexed": indexed, "errors": errors}
+        
+        with ThreadPoolExecutor(max_workers=self.INDEX_BUILD_WORKERS) as pool:
+            futures = {
+                pool.submit(self._ensure_table_indexes, name, cols, sum_cols.get(name, ())): name
+                for name, cols in pending.items()
+            }
+            for future in as_completed(futures):
+                safe_name = futures[future]
+                try:
+                    if future.result():
+                        indexed.append(safe_name)
+                except Exception as e:
+                    errors.append(f"{safe_name}: {e}")
+        
+        return {"status": "success" if not errors else "partial", "indexed": indexed, "errors": errors}
+
+    def get_table_meta(self, table_id: int) -> Optional[TableMeta]:
+        """Cached table metadata (process-local, invalidated across workers via the 'table_meta' version)"""
+        return _load_table_meta(table_id, cache.get_version("table_meta"))
+    
+    def invalidate_table_meta(self) -> None:
+        """Call after any change to table or column definitions"""
+        cache.bump_version("table_meta")
+        _load_table_meta.cache_clear()
+        # Grafana responses (incl. the /tables dropdown) are built from this metadata
+        invalidate_grafana_cache()
+    
     def get_all_tables(self) -> List[Dict]:
         """Get all table definitions"""
         with get_db_context() as db:
@@ -58,7 +287,11 @@ class TableService:
     
     def register_existing_table(self, name: str, display_name: str, description: str = None, columns: List[Dict] = []) -> Dict[str, Any]:
         """Register EXISTING physical table (metadata only, NO DDL)"""
-        # Name is already safe because it comes from SchemaInspector which reads actual DB tables
+        # Name comes from SchemaInspector (actual DB tables), but it is still interpolated
+        # into generated SQL later, so reject anything that is not a plain identifier now
+        invalid = [n for n in [name] + [col['name'] for col in columns] if not SQL_IDENTIFIER.match(n)]
+        if invalid:
+            return {"status": "error", "message": f"Nama tabel/kolom tidak valid: {', '.join(invalid)}"}
         
         with get_db_context() as db:
             try:
@@ -95,6 +328,7 @@ class TableService:
                 
                 db.commit()
                 db.refresh(table)
+                self.invalidate_table_meta()
                 return {"status": "success", "data": table.to_dict(include_columns=True)}
                 
             except Exception as e:
@@ -170,11 +404,13 @@ class TableService:
                 
                 db.execute(text(ddl))
                 
-                # Add indexes for performance
+                # Add indexes for performance (all in one statement / round-trip)
                 try:
-                    db.execute(text(f"CREATE INDEX IF NOT EXISTS idx_{safe_name}_unit_kerja_id ON {safe_name} (unit_kerja_id)"))
-                    db.execute(text(f"CREATE INDEX IF NOT EXISTS idx_{safe_name}_tanggal ON {safe_name} (tanggal)"))
-                    db.execute(text(f"CREATE INDEX IF NOT EXISTS idx_{safe_name}_unit_tanggal ON {safe_name} (unit_kerja_id, tanggal)"))
+                    sum_cols = [
+                        self._sanitize_name(col.name) for col in column_defs
+                        if col.is_summable and col.data_type == "integer"
+                    ]
+                    db.execute(text(self._index_ddl(safe_name, sum_cols=sum_cols)))
                 except Exception as e:
                     print(f"Warning: Failed to create indexes: {e}")
 
@@ -185,6 +421,7 @@ class TableService:
                     pass # Ignore if fails (e.g. SQLite limitations)
                 
                 db.commit()
+                self.invalidate_table_meta()
                 
                 # Fetch fresh object with columns for return
                 try:
@@ -222,6 +459,7 @@ class TableService:
                 
                 db.commit()
                 db.refresh(table)
+                self.invalidate_table_meta()
                 return {"status": "success", "data": table.to_dict()}
             except Exception as e:
                 db.rollback()
@@ -259,6 +497,7 @@ class TableService:
                 # Delete Metadata
                 db.delete(table)
                 db.commit()
+                self.invalidate_table_meta()
                 return {"status": "success", "message": f"Tabel {table.display_name} berhasil dihapus permanen"}
             except Exception as e:
                 db.rollback()
@@ -289,7 +528,8 @@ class TableService:
             
             if not has_date_filter:
                 # ===== FAST PATH: No date filter =====
-                # Step 1: Get IDs quickly using primary key index (instant)
+                # Deferred join: page through IDs on the primary key index in a derived table,
+                # then JOIN the full rows for only that page (one round-trip, no literal ID list)
                 id_query = f"SELECT t.id FROM {safe_name} t"
                 id_where = ["1=1"]
                 
@@ -307,39 +547,36 @@ class TableService:
                 params['limit'] = limit
                 params['offset'] = offset
                 
-                id_rows = db.execute(text(id_query), params).fetchall()
-                
-                if not id_rows:
-                    return {"data": [], "total": 0}
-                
-                ids = [r[0] for r in id_rows]
-                
-                # Step 2: Get full data for only these IDs (JOIN on tiny set = instant)
                 query = f"""
                     SELECT t.*, u.nama as unit_nama, i.nama as instansi_nama 
-                    FROM {safe_name} t
+                    FROM ({id_query}) page
+                    JOIN {safe_name} t ON t.id = page.id
                     JOIN unit_kerja u ON t.unit_kerja_id = u.id
                     JOIN instansi i ON u.instansi_id = i.id
-                    WHERE t.id IN ({','.join(str(i) for i in ids)})
                     ORDER BY t.id DESC
                 """
                 
+                rows = db.execute(text(query), params).mappings().all()
+                if not rows:
+                    return {"data": [], "total": 0}
+                
                 # Step 3: Approximate total (skip COUNT(*))
                 cache_key = f"total_count_{table_id}"
                 total = cache.get(cache_key)
                 if total is None:
                     try:
-                        status_sql = f"SHOW TABLE STATUS LIKE '{safe_name}'"
-                        status_res = db.execute(text(status_sql)).mappings().one_or_none()
-                        if status_res and status_res.get('Rows') is not None:
-                            total = int(status_res['Rows'])
+                        # Single-row metadata lookup (cheaper than SHOW TABLE STATUS)
+                        rows_estimate = db.execute(text(
+                            "SELECT table_rows FROM information_schema.TABLES "
+                            "WHERE table_schema = DATABASE() AND table_name = :t"
+                        ), {"t": safe_name}).scalar()
+                        if rows_estimate is not None:
+                            total = int(rows_estimate)
                             cache.set(cache_key, total, ttl=300)
                     except Exception:
                         pass
                 if total is None:
                     total = 100000
-                
-                rows = db.execute(text(query)).mappings().all()
             else:
                 # ===== NORMAL PATH: With date filter (small dataset, JOINs are fast) =====
                 query = f"""
@@ -562,6 +799,7 @@ class TableService:
                 cache.invalidate_prefix(f"stats_table")
                 cache.delete(f"total_count_{table_id}")
                 cache.delete("dashboard_stats")
+                invalidate_grafana_cache(table_id)
                 
                 # [AUTO-UPDATE SUMMARY]
                 try:
@@ -577,11 +815,36 @@ class TableService:
                 db.rollback()
                 return {"status": "error", "message": str(e)}
 
-    def upsert_data(self, table_id: int, unit_kerja_id: int, tanggal: date, data: Dict[str, Any], db=None, table_obj=None) -> Dict[str, Any]:
+    def _composite_in(self, columns: tuple, keys: List[tuple], params: Dict[str, Any]) -> str:
+        """Expand (a, b) IN ((..), (..)) into OR-ed ANDs so MySQL can seek the composite index"""
+        clauses = []
+        for i, key in enumerate(keys):
+            parts = []
+            for j, col in enumerate(columns):
+                params[f"k{i}_{j}"] = key[j]
+                parts.append(f"{col} = :k{i}_{j}")
+            clauses.append(f"({' AND '.join(parts)})")
+        return " OR ".join(clauses)
+
+    def get_existing_keys(self, db, table_name: str, keys, batch_size: int = 500) -> set:
+        """Return which (unit_kerja_id, tanggal) keys already exist in a physical table"""
+        safe_name = self._sanitize_name(table_name)
+        keys = list(keys)
+        found = set()
+        
+        for start in range(0, len(keys), batch_size):
+            params = {}
+            where = self._composite_in(("unit_kerja_id", "tanggal"), keys[start:start + batch_size], params)
+            rows = db.execute(text(f"SELECT unit_kerja_id, tanggal FROM {safe_name} WHERE {where}"), params).fetchall()
+            found.update((row[0], row[1]) for row in rows)
+        return found
+
+    def upsert_data(self, table_id: int, unit_kerja_id: int, tanggal: date, data: Dict[str, Any], db=None, table_obj=None, existing_keys: Optional[set] = None) -> Dict[str, Any]:
         """
         Upsert (Insert or Merge/Sum) data into PHYSICAL table
         :param db: Optional SQLAlchemy Session. If provided, function will NOT commit.
         :param table_obj: Optional TableDefinition object. If provided, skips looking it up.
+        :param existing_keys: Optional set from get_existing_keys(). Keys not in it are inserted without a lookup.
         """
         # Helper to run logic inside a session
         def _process(session, tbl):
@@ -598,7 +861,11 @@ class TableService:
                 sel_cols = ["id", "total"] + [self._sanitize_name(c.name) for c in tbl.columns]
                 sel_sql = f"SELECT {', '.join(sel_cols)} FROM {safe_name} WHERE unit_kerja_id = :uid AND tanggal = :tgl"
                 
-                existing = session.execute(text(sel_sql), {"uid": unit_kerja_id, "tgl": tanggal}).mappings().first()
+                key = (unit_kerja_id, tanggal)
+                if existing_keys is not None and key not in existing_keys:
+                    existing = None  # Known new key, skip the lookup
+                else:
+                    existing = session.execute(text(sel_sql), {"uid": unit_kerja_id, "tgl": tanggal}).mappings().first()
                 
                 if existing:
                     # UPDATE (Merge Sums)
@@ -638,6 +905,7 @@ class TableService:
                     cache.invalidate_prefix(f"stats_table")
                     cache.delete(f"total_count_{table_id}")
                     cache.delete("dashboard_stats")
+                    invalidate_grafana_cache(table_id)
                     
                     # [AUTO-UPDATE SUMMARY]
                     try:
@@ -674,11 +942,14 @@ class TableService:
                     sql = f"INSERT INTO {safe_name} ({', '.join(cols)}) VALUES ({', '.join(vals)})"
                     session.execute(text(sql), params)
                     if not db: session.commit()
+                    if existing_keys is not None:
+                        existing_keys.add(key)
                     
                     # Invalidate cache
                     cache.invalidate_prefix(f"stats_table")
                     cache.delete(f"total_count_{table_id}")
                     cache.delete("dashboard_stats")
+                    invalidate_grafana_cache(table_id)
                     
                     # [AUTO-UPDATE SUMMARY]
                     try:
@@ -782,6 +1053,7 @@ class TableService:
                 cache.invalidate_prefix(f"stats_table")
                 cache.delete(f"total_count_{table_id}")
                 cache.delete("dashboard_stats")
+                invalidate_grafana_cache(table_id)
                 
                 # [AUTO-UPDATE SUMMARY]
                 try:
@@ -831,6 +1103,7 @@ class TableService:
                 cache.invalidate_prefix(f"stats_table")
                 cache.delete(f"total_count_{table_id}")
                 cache.delete("dashboard_stats")
+                invalidate_grafana_cache(table_id)
                 
                 # [AUTO-UPDATE SUMMARY] - Step 2: Update Summary AFTER Delete
                 if meta:
@@ -223,8 +223,9 @@ class UploadService:
         
         result["stats"]["total_rows"] = len(df)
         
-        # Process each row
+        # Pass 1: parse and resolve each row
         print(f"[Upload] Starting bulk process for {len(df)} rows...")
+        parsed_rows = []
         for idx, row in df.iterrows():
             try:
                 # Get unit kerja
@@ -261,15 +262,34 @@ class UploadService:
                     else:
                          json_data[name] = 0 if col['data_type'] == 'integer' else ''
                 
+                parsed_rows.append((idx, unit.id, tanggal, json_data))
+                
+            except Exception as e:
+                result["stats"]["skipped"] += 1
+                result["stats"]["errors"].append(f"Baris {idx+2}: {str(e)}")
+        
+        # Look up which (unit_kerja_id, tanggal) keys already exist in batches
+        try:
+            existing_keys = table_service.get_existing_keys(
+                self.db, table_def_obj.name, {(uid, tgl) for _, uid, tgl, _ in parsed_rows}
+            )
+        except Exception as e:
+            print(f"[Upload] Warning: key prefetch failed, falling back to per-row lookup - {e}")
+            existing_keys = None
+        
+        # Pass 2: upsert
+        for idx, unit_kerja_id, tanggal, json_data in parsed_rows:
+            try:
                 # Call TableService to Upsert (Insert/Sum) into Physical Table
                 # PASS SESSION AND TABLE OBJECT FOR OPTIMIZATION
                 upsert_res = table_service.upsert_data(
                     table_id=table_id,
-                    unit_kerja_id=unit.id,
+                    unit_kerja_id=unit_kerja_id,
                     tanggal=tanggal,
                     data=json_data,
                     db=self.db,           # reuse session
-                    table_obj=table_def_obj # reuse definition
+                    table_obj=table_def_obj, # reuse definition
+                    existing_keys=existing_keys
                 )
                 
                 if upsert_res["status"] == "success":
@@ -0,0 +1,32 @@
+"""Add composite (unit_kerja_id, tanggal) index on data_arsip
+
+Revision ID: 4c1e6f2a9b3d
+Revises: 8b490322e230
+Create Date: 2026-02-10 10:12:30.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4c1e6f2a9b3d'
+down_revision: Union[str, None] = '8b490322e230'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Equality column first, range column (tanggal) last
+    op.create_index('ix_data_arsip_unit_kerja_tanggal', 'data_arsip', ['unit_kerja_id', 'tanggal'], unique=False)
+
+    # Single-column unit_kerja_id index is now a redundant prefix of the composite
+    # (the composite also backs the unit_kerja_id foreign key)
+    op.drop_index('ix_data_arsip_unit_kerja_id', table_name='data_arsip')
+
+
+def downgrade() -> None:
+    op.create_index('ix_data_arsip_unit_kerja_id', 'data_arsip', ['unit_kerja_id'], unique=False)
+    op.drop_index('ix_data_arsip_unit_kerja_tanggal', table_name='data_arsip')
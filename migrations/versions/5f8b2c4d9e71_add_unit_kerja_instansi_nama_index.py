@@ -0,0 +1,32 @@
+"""Add composite (instansi_id, nama) index on unit_kerja
+
+Revision ID: 5f8b2c4d9e71
+Revises: 4c1e6f2a9b3d
+Create Date: 2026-02-11 09:20:45.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5f8b2c4d9e71'
+down_revision: Union[str, None] = '4c1e6f2a9b3d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Grafana unit kerja dropdown: WHERE instansi_id IN (...) ORDER BY nama.
+    # Covering (InnoDB appends id) and already in nama order per instansi, so no table lookups.
+    op.create_index('ix_unit_kerja_instansi_nama', 'unit_kerja', ['instansi_id', 'nama'], unique=False)
+
+    # Single-column instansi_id index is now a redundant prefix (the composite backs the FK)
+    op.drop_index('ix_unit_kerja_instansi_id', table_name='unit_kerja')
+
+
+def downgrade() -> None:
+    op.create_index('ix_unit_kerja_instansi_id', 'unit_kerja', ['instansi_id'], unique=False)
+    op.drop_index('ix_unit_kerja_instansi_nama', table_name='unit_kerja')
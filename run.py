@@ -1,6 +1,7 @@
 """
 Run script untuk SPLP Data Integrator
 Usage: python run.py
+       python run.py --ensure-indexes   (create missing indexes on dynamic tables, then exit)
 
 Features:
 - Auto-create .env from .env.example
@@ -105,6 +106,24 @@ def run_migrations():
         return False
 
 
+def ensure_indexes():
+    """Create missing indexes on registered dynamic tables"""
+    try:
+        from app.services.table_service import table_service
+        
+        result = table_service.ensure_indexes()
+        if result["indexed"]:
+            print(f"[Index] Indexes created on: {', '.join(result['indexed'])}")
+        else:
+            print("[Index] All tables already indexed")
+        for error in result["errors"]:
+            print(f"  -> Warning: {error}")
+        return True
+    except Exception as e:
+        print(f"[Index] Warning: Could not ensure indexes - {e}")
+        return False
+
+
 def create_default_admin():
     """Create default admin user if not exists"""
     try:
@@ -142,6 +161,11 @@ def create_default_admin():
 
 
 if __name__ == "__main__":
+    # Index DDL can lock large tables for a long time, so it is an explicit
+    # maintenance command instead of a startup step
+    if "--ensure-indexes" in sys.argv[1:]:
+        sys.exit(0 if ensure_indexes() else 1)
+    
     print("=" * 50)
     print("  SPLP Data Integrator - Starting...")
     print("=" * 50)
@@ -0,0 +1,97 @@
+"""
+Tests for the SQL filter helpers shared by the stats/Grafana endpoints
+"""
+from datetime import date
+
+from app.api.stats_routes import _build_filters, _parse_int_list, _tanggal_range_condition
+
+
+def test_tanggal_range_single_year():
+    params = {}
+    sql = _tanggal_range_condition([2024], params)
+    
+    assert sql == "t.tanggal >= :tanggal_start_0 AND t.tanggal < :tanggal_end_0"
+    assert params == {"tanggal_start_0": date(2024, 1, 1), "tanggal_end_0": date(2025, 1, 1)}
+
+
+def test_tanggal_range_merges_december_into_next_january():
+    params = {}
+    sql = _tanggal_range_condition([2025, 2024], params, months=[12, 1])
+    
+    # Jan 2024 | Dec 2024 + Jan 2025 (adjacent, one range) | Dec 2025
+    assert sql == (
+        "((t.tanggal >= :tanggal_start_0 AND t.tanggal < :tanggal_end_0)"
+        " OR (t.tanggal >= :tanggal_start_1 AND t.tanggal < :tanggal_end_1)"
+        " OR (t.tanggal >= :tanggal_start_2 AND t.tanggal < :tanggal_end_2))"
+    )
+    assert params == {
+        "tanggal_start_0": date(2024, 1, 1), "tanggal_end_0": date(2024, 2, 1),
+        "tanggal_start_1": date(2024, 12, 1), "tanggal_end_1": date(2025, 2, 1),
+        "tanggal_start_2": date(2025, 12, 1), "tanggal_end_2": date(2026, 1, 1),
+    }
+
+
+def test_tanggal_range_without_valid_years_matches_nothing():
+    params = {}
+    
+    assert _tanggal_range_condition([], params) == "1 = 0"
+    assert _tanggal_range_condition([0, 10000], params, months=[13]) == "1 = 0"
+    assert params == {}
+
+
+def test_build_filters_raw_table():
+    join_clause, where_clause, params = _build_filters([2024], [3])
+    
+    assert join_clause == ""
+    assert where_clause == "WHERE t.tanggal >= :tanggal_start_0 AND t.tanggal < :tanggal_end_0"
+    assert params == {"tanggal_start_0": date(2024, 3, 1), "tanggal_end_0": date(2024, 4, 1)}
+
+
+def test_build_filters_without_filters():
+    assert _build_filters([], []) == ("", "", {})
+
+
+def test_build_filters_ands_instansi_and_unit_kerja():
+    join_clause, where_clause, params = _build_filters([], [], [1], [5, 6])
+    
+    assert join_clause == "JOIN unit_kerja u ON t.unit_kerja_id = u.id"
+    assert where_clause == "WHERE t.unit_kerja_id IN :unit_kerja_ids AND u.instansi_id = :instansi_id"
+    assert params == {"unit_kerja_ids": [5, 6], "instansi_id": 1}
+
+
+def test_build_filters_summary_year_and_months():
+    join_clause, where_clause, params = _build_filters([2023, 2024], [1, 12], use_summary=True)
+    
+    assert join_clause == ""
+    assert where_clause == "WHERE t.month IN :year_months"
+    assert params == {"year_months": ["2023-01", "2023-12", "2024-01", "2024-12"]}
+
+
+def test_build_filters_summary_year_only():
+    assert _build_filters([2024], None, use_summary=True) == ("", "WHERE t.year = :year", {"year": 2024})
+    assert _build_filters([2023, 2024], None, use_summary=True) == (
+        "", "WHERE t.year IN :years", {"years": [2023, 2024]}
+    )
+
+
+def test_build_filters_summary_months_only():
+    _, where_clause, params = _build_filters([], [3, 11], use_summary=True)
+    
+    assert where_clause == "WHERE SUBSTRING(t.month, 6, 2) IN :months"
+    assert params == {"months": ["03", "11"]}
+
+
+def test_parse_int_list_grafana_values():
+    assert _parse_int_list("2024") == [2024]
+    assert _parse_int_list("1,2, 3") == [1, 2, 3]
+    assert _parse_int_list("{1,2}") == [1, 2]
+
+
+def test_parse_int_list_all_blank_and_non_numeric():
+    assert _parse_int_list(None) == []
+    assert _parse_int_list("") == []
+    assert _parse_int_list("   ") == []
+    assert _parse_int_list("$__all") == []
+    assert _parse_int_list("${instansi}") == []
+    assert _parse_int_list("abc,12x,x12,1.5") == []
+    assert _parse_int_list("abc,7") == [7]